@@ -4,6 +4,19 @@ import { Mail, ArrowLeft } from "lucide-react"
 import axios from "axios"
 import { Button } from "@/components/ui/button"
 
+// The list endpoints return one page at a time; the cursor of the next page
+// comes back in the X-Next-Cursor header until the last page
+const fetchAllPages = async (url) => {
+  const items = []
+  let cursor = null
+  do {
+    const response = await axios.get(url, { params: { limit: 1000, cursor: cursor || undefined } })
+    items.push(...response.data)
+    cursor = response.headers["x-next-cursor"]
+  } while (cursor)
+  return items
+}
+
 export default function Email() {
   const [emails, setEmails] = useState([])
   const [selectedEmail, setSelectedEmail] = useState(null)
@@ -12,9 +25,9 @@ export default function Email() {
   useEffect(() => {
     const fetchEmails = async () => {
       try {
-        const response = await axios.get("http://localhost:8000/sentiment/emails")
-        console.log(response.data)
-        setEmails(response.data)
+        const emails = await fetchAllPages("http://localhost:8000/sentiment/emails")
+        console.log(emails)
+        setEmails(emails)
       } catch (error) {
         console.log(error)
       }
@@ -26,8 +39,7 @@ export default function Email() {
   useEffect(() => {
     const fetchTasks = async () => {
       try {
-        const response = await axios.get("http://localhost:8000/tasks")
-        setTasks(response.data)
+        setTasks(await fetchAllPages("http://localhost:8000/tasks"))
       } catch (error) {
         console.log(error)
       }
@@ -36,8 +48,15 @@ export default function Email() {
     fetchTasks()
   }, [])
 
-  const showEmailDetails = (email) => {
+  const showEmailDetails = async (email) => {
     setSelectedEmail(email)
+    // The list only carries a snippet; fetch the full body on demand
+    try {
+      const response = await axios.get(`http://localhost:8000/sentiment/emails/${email.msg_id}`)
+      setSelectedEmail(response.data)
+    } catch (error) {
+      console.log(error)
+    }
   }
 
   const goBack = () => {
@@ -78,7 +97,7 @@ export default function Email() {
                       {format(new Date(email.processed_at), "MMM d, yyyy")}
                     </span>
                   </div>
-                  <p className="mt-1 text-sm text-gray-600 truncate">{email.body}</p>
+                  <p className="mt-1 text-sm text-gray-600 truncate">{email.snippet}</p>
                 </div>
               ))}
             </div>
@@ -104,7 +123,7 @@ export default function Email() {
                 Sentiment: {selectedEmail.sentiment} (Confidence: {(selectedEmail.confidence * 100).toFixed(2)}%)
               </p>
               <div className="bg-gray-100 p-4 rounded">
-                <p className="whitespace-pre-wrap">{selectedEmail.body}</p>
+                <p className="whitespace-pre-wrap">{selectedEmail.body ?? selectedEmail.snippet}</p>
               </div>
             </div>
           </div>
@@ -1,16 +1,13 @@
 
 
-import openai
+import asyncio
 import sqlite3
 from datetime import datetime, timedelta
 import os
 import json
 import ray
 import base64
-from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 import logging
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -18,11 +15,19 @@ from dotenv import load_dotenv
 import re
 from datetime import datetime, timedelta
 import pytz
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import threading
-from typing import List, Tuple
-from transformers import pipeline
+from typing import List, Optional, Tuple
+import db
+from body_store import compress_body, make_snippet
+from calendar_index import get_calendar_index
+from gmail_message import extract_text, header, internal_date, sender_address
+from google_clients import get_service
+from llm_cache import get_llm_cache
+from llm_client import get_llm_client
+from processed_messages import get_processed_messages
+from sentiment_model import get_sentiment_model
+from slot_finder import find_free_slots, BUFFER
 
 load_dotenv()
 
@@ -30,8 +35,6 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-LATEST_HISTORY_ID = None
-
 openai_api_key = os.getenv('OPENAI_API_KEY')
 # Define Gmail API SCOPES
 SCOPES = [
@@ -40,14 +43,33 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.modify',
     'https://www.googleapis.com/auth/calendar'
 ]
+
+# Number of days after the requested one searched for alternative slots
+SLOT_SEARCH_DAYS = int(os.getenv('SLOT_SEARCH_DAYS', '3'))
+
+# Bump a prompt version whenever its template changes so cached responses are not reused
+PARSE_PROMPT_VERSION = 1
+TASKS_PROMPT_VERSION = 1
+INSIGHTS_PROMPT_VERSION = 1
+# Seconds a cached response stays valid. Meeting parsing depends on the current
+# time in the prompt; task due dates default to "two weeks from today".
+PARSE_CACHE_TTL = int(os.getenv('PARSE_CACHE_TTL', '600'))
+TASKS_CACHE_TTL = int(os.getenv('TASKS_CACHE_TTL', '86400'))
+
+# 'combined' extracts meeting details and tasks in one call per email;
+# 'separate' uses the original task and meeting extraction calls.
+EXTRACTION_MODE = os.getenv('EMAIL_EXTRACTION_MODE', 'combined')
+# Note that combined mode moves task extraction off gpt-4: the strict JSON
+# schema response format needs a gpt-4o model. Set EMAIL_EXTRACTION_MODE=separate
+# to keep extracting tasks with gpt-4.
+COMBINED_EXTRACTION_MODEL = os.getenv('COMBINED_EXTRACTION_MODEL', 'gpt-4o-mini')
+
 def check_calendar_conflicts(creds, proposed_start: datetime, proposed_end: datetime) -> List[dict]:
     """
     Check for calendar conflicts within a specified time range.
     Handles timezone-aware datetime comparisons properly.
     """
     try:
-        service = build('calendar', 'v3', credentials=creds)
-        
         # Ensure proposed times are UTC
         if proposed_start.tzinfo is None:
             proposed_start = proposed_start.replace(tzinfo=pytz.UTC)
@@ -55,39 +77,17 @@ def check_calendar_conflicts(creds, proposed_start: datetime, proposed_end: date
             proposed_end = proposed_end.replace(tzinfo=pytz.UTC)
         
         # Add buffer time (15 minutes before and after)
-        buffer_start = (proposed_start - timedelta(minutes=15)).isoformat()
-        buffer_end = (proposed_end + timedelta(minutes=15)).isoformat()
+        buffer_start = proposed_start - timedelta(minutes=15)
+        buffer_end = proposed_end + timedelta(minutes=15)
         
-        events_result = service.events().list(
-            calendarId='primary',
-            timeMin=buffer_start,
-            timeMax=buffer_end,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
+        # Query the local index instead of listing events from Google every time
+        index = get_calendar_index()
+        index.refresh(creds)
         
         conflicts = []
-        for event in events_result.get('items', []):
-            # Convert event times to UTC datetime objects
-            event_start_str = event['start'].get('dateTime', event['start'].get('date'))
-            event_end_str = event['end'].get('dateTime', event['end'].get('date'))
-            
-            # Parse the datetime strings and ensure UTC timezone
-            event_start = datetime.fromisoformat(event_start_str.replace('Z', '+00:00'))
-            event_end = datetime.fromisoformat(event_end_str.replace('Z', '+00:00'))
-            
-            if not event_start.tzinfo:
-                event_start = event_start.replace(tzinfo=pytz.UTC)
-            if not event_end.tzinfo:
-                event_end = event_end.replace(tzinfo=pytz.UTC)
-            
-            if (event_start <= proposed_end and event_end >= proposed_start):
-                conflicts.append({
-                    'summary': event['summary'],
-                    'start': event_start,
-                    'end': event_end,
-                    'attendees': event.get('attendees', [])
-                })
+        for event in index.overlapping(buffer_start, buffer_end):
+            if (event['start'] <= proposed_end and event['end'] >= proposed_start):
+                conflicts.append(event)
         
         return conflicts
     
@@ -95,44 +95,38 @@ def check_calendar_conflicts(creds, proposed_start: datetime, proposed_end: date
         logger.error(f"Error checking calendar conflicts: {e}")
         return []
 
-def suggest_alternative_times(creds, base_datetime: datetime, conflicts: List[dict]) -> List[datetime]:
+def suggest_alternative_times(creds, base_datetime: datetime, conflicts: List[dict],
+                              duration: timedelta = timedelta(hours=1)) -> List[datetime]:
     """
     Suggest alternative meeting times based on conflicts.
-    Ensures consistent timezone handling.
+    Busy time for the whole search horizon is read once and swept for free slots.
     """
     # Ensure base_datetime is UTC
     if base_datetime.tzinfo is None:
         base_datetime = base_datetime.replace(tzinfo=pytz.UTC)
     
-    suggestions = []
-    
-    # Try next few days, same time
-    for i in range(1, 4):
-        next_day = base_datetime + timedelta(days=i)
-        if not check_calendar_conflicts(creds, next_day, next_day + timedelta(hours=1)):
-            suggestions.append(next_day)
-            if len(suggestions) >= 3:
-                break
+    # Search from the start of the requested day through the next few days
+    window_start = max(
+        base_datetime.replace(hour=0, minute=0, second=0, microsecond=0),
+        datetime.now(pytz.UTC)
+    )
+    window_end = base_datetime.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=SLOT_SEARCH_DAYS + 1)
     
-    # Try same day, different times
-    if len(suggestions) < 3:
-        base_date = base_datetime.date()
-        for hour in [9, 10, 11, 14, 15, 16]:  # Common meeting hours
-            alternative_time = datetime.combine(base_date, datetime.min.time().replace(hour=hour))
-            alternative_time = alternative_time.replace(tzinfo=pytz.UTC)
-            
-            if alternative_time > datetime.now(pytz.UTC) and not check_calendar_conflicts(
-                creds, 
-                alternative_time, 
-                alternative_time + timedelta(hours=1)
-            ):
-                suggestions.append(alternative_time)
-                if len(suggestions) >= 3:
-                    break
+    try:
+        index = get_calendar_index()
+        index.refresh(creds)
+        busy = [
+            (event['start'], event['end'])
+            for event in index.overlapping(window_start - BUFFER, window_end + BUFFER)
+        ]
+    except Exception as e:
+        logger.error(f"Error reading busy intervals: {e}")
+        return []
     
-    return suggestions
+    return find_free_slots(busy, window_start, window_end, duration, k=3, preferred=base_datetime)
 
-def parse_natural_language(text, sender_email):
+async def aparse_natural_language(text, sender_email):
+    """Extract intent, meeting entities and attendees from text as a JSON string."""
     current_datetime = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')
     prompt = (
         f"Today's date and time is {current_datetime}. "
@@ -154,8 +148,21 @@ def parse_natural_language(text, sender_email):
         "  \"is_sender_required\": true\n"
         "}"
     )
+    # The prompt embeds the current time, so relative dates ("tomorrow at 3") only
+    # resolve the same way on the same UTC day and for a short while.
+    cache = get_llm_cache()
+    cache_key = cache.key(
+        "gpt-4o-mini",
+        PARSE_PROMPT_VERSION,
+        f"{datetime.utcnow().strftime('%Y-%m-%d')}\n{sender_email}\n{text}"
+    )
     try:
-        response = openai.chat.completions.create(
+        # The cache is SQLite; keep its reads and writes off the event loop
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            return cached
+
+        raw_content = await get_llm_client().complete(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are an assistant that extracts intents and entities from text, ensuring attendee information is accurate."},
@@ -164,20 +171,138 @@ def parse_natural_language(text, sender_email):
             max_tokens=150,
             temperature=0.5,
         )
-        raw_content = response.choices[0].message.content.strip()
         if raw_content.startswith("```json") and raw_content.endswith("```"):
             raw_content = raw_content[7:-3].strip()
 
+        await asyncio.to_thread(cache.put, cache_key, "gpt-4o-mini", raw_content, PARSE_CACHE_TTL)
         return raw_content
 
     except Exception as e:
         logger.error(f"Error parsing natural language: {e}")
         return "{}"
 
+def parse_natural_language(text, sender_email):
+    return get_llm_client().run(aparse_natural_language(text, sender_email))
+
+# JSON schema for the combined extraction; enforced by the API and re-checked locally
+EMAIL_INSIGHTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": ["schedule", "reschedule", "cancel", "none"]},
+        "title": {"type": ["string", "null"]},
+        "old_date": {"type": ["string", "null"]},
+        "old_time": {"type": ["string", "null"]},
+        "new_date": {"type": ["string", "null"]},
+        "new_time": {"type": ["string", "null"]},
+        "attendees": {"type": "array", "items": {"type": "string"}},
+        "is_sender_required": {"type": "boolean"},
+        "tasks": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string"},
+                    "project": {"type": "string"},
+                    "assignee": {"type": "array", "items": {"type": "string"}},
+                    "dueDate": {"type": "string"},
+                    "status": {"type": "string", "enum": ["Not started"]}
+                },
+                "required": ["title", "project", "assignee", "dueDate", "status"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": [
+        "intent", "title", "old_date", "old_time", "new_date", "new_time",
+        "attendees", "is_sender_required", "tasks"
+    ],
+    "additionalProperties": False
+}
+
+MEETING_FIELDS = ["intent", "title", "old_date", "old_time", "new_date", "new_time", "attendees", "is_sender_required"]
+
+def validate_email_insights(data) -> dict:
+    """Check a combined extraction against EMAIL_INSIGHTS_SCHEMA; raise ValueError if it does not fit."""
+    if not isinstance(data, dict):
+        raise ValueError("Extraction is not an object")
+    missing = [key for key in EMAIL_INSIGHTS_SCHEMA["required"] if key not in data]
+    if missing:
+        raise ValueError(f"Extraction is missing {missing}")
+    for key in ["title", "old_date", "old_time", "new_date", "new_time"]:
+        if data[key] is not None and not isinstance(data[key], str):
+            raise ValueError(f"Field '{key}' must be a string or null")
+    if not isinstance(data["intent"], str):
+        raise ValueError("Field 'intent' must be a string")
+    if not isinstance(data["attendees"], list) or not all(isinstance(a, str) for a in data["attendees"]):
+        raise ValueError("Field 'attendees' must be a list of strings")
+    if not isinstance(data["is_sender_required"], bool):
+        raise ValueError("Field 'is_sender_required' must be a boolean")
+    if not isinstance(data["tasks"], list):
+        raise ValueError("Field 'tasks' must be a list")
+    return data
+
+async def aextract_email_insights(text, sender_email):
+    """
+    Extract the meeting request and the action items of an email in one model call.
+    Returns a dict shaped like EMAIL_INSIGHTS_SCHEMA, or None if extraction failed.
+    """
+    current_datetime = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')
+    prompt = (
+        f"Today's date and time is {current_datetime}. "
+        "From the email below, extract two things in a single JSON object.\n\n"
+        "1. The meeting request: the intent ('schedule', 'reschedule', 'cancel' or 'none'), "
+        "the meeting title, 'new_date' (YYYY-MM-DD) and 'new_time' (HH:MM, 24h), and for a "
+        "reschedule the current 'old_date' and 'old_time'. Use null for anything not mentioned. "
+        "List the attendees' emails, interpreting 'me' as the sender, and set 'is_sender_required' "
+        "if the sender explicitly wants to be added to the attendees list.\n"
+        "2. The actionable tasks, each with title, project ('General' if not specified), "
+        "assignee (one of the names in the email), dueDate (YYYY-MM-DD, two weeks from today "
+        "if none is given) and status 'Not started'. Use an empty list if there are none.\n\n"
+        f"Sender Email: {sender_email}\n"
+        f"Email Content:\n{text}"
+    )
+
+    # Same time sensitivity as parse_natural_language
+    cache = get_llm_cache()
+    cache_key = cache.key(
+        COMBINED_EXTRACTION_MODEL,
+        INSIGHTS_PROMPT_VERSION,
+        f"{datetime.utcnow().strftime('%Y-%m-%d')}\n{sender_email}\n{text}"
+    )
+    try:
+        content = await asyncio.to_thread(cache.get, cache_key)
+        cached = content is not None
+        if not cached:
+            content = await get_llm_client().complete(
+                model=COMBINED_EXTRACTION_MODEL,
+                messages=[
+                    {"role": "system", "content": "You extract meeting requests and action items from emails as JSON."},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": {"name": "email_insights", "schema": EMAIL_INSIGHTS_SCHEMA, "strict": True}
+                },
+                temperature=0.3,
+                max_tokens=1000,
+            )
+
+        insights = validate_email_insights(json.loads(content))
+        if not cached:
+            await asyncio.to_thread(cache.put, cache_key, COMBINED_EXTRACTION_MODEL, content, PARSE_CACHE_TTL)
+        return insights
+
+    except Exception as e:
+        logger.error(f"Error extracting email insights: {e}")
+        return None
+
+def extract_email_insights(text, sender_email):
+    return get_llm_client().run(aextract_email_insights(text, sender_email))
+
 def create_google_calendar_event(creds, title, date, time, attendees):
     """Create an event in Google Calendar."""
     try:
-        service = build('calendar', 'v3', credentials=creds)
+        service = get_service('calendar', 'v3', creds)
         
         # Convert attendees set to a list of dictionaries
         attendees_list = [{'email': attendee} for attendee in attendees]
@@ -195,6 +320,7 @@ def create_google_calendar_event(creds, title, date, time, attendees):
             'attendees': attendees_list,
         }
         event_result = service.events().insert(calendarId='primary', body=event).execute()
+        get_calendar_index().invalidate()
         logger.info(f"Event created: {event_result['summary']}")
         return f"Event created successfully: {event_result.get('htmlLink')}"
     except HttpError as error:
@@ -259,8 +385,13 @@ def send_calendar_invitation(service, to_email, event, meeting_id):
         logger.error(f"Error sending calendar invitation: {e}")
 
 @ray.remote
-def schedule_meeting(text, from_email):
-    parsed = parse_natural_language(text, from_email)
+def schedule_meeting(text, from_email, parsed=None):
+    return handle_schedule_request(text, from_email, parsed)
+
+def handle_schedule_request(text, from_email, parsed=None):
+    """Schedule the meeting requested in text; parsed skips the extraction call when given."""
+    if parsed is None:
+        parsed = parse_natural_language(text, from_email)
     try:
         data = json.loads(parsed)
         intent = data.get('intent', '').lower()
@@ -268,8 +399,9 @@ def schedule_meeting(text, from_email):
             logger.warning(f"Unrecognized intent: {intent}. Email will not be sent.")
             return f"Intent '{intent}' not recognized for scheduling. No email sent."
 
-        title = data.get('title', 'Meeting')
-        date = data.get('new_date', datetime.utcnow().strftime('%Y-%m-%d'))
+        # Extractions use null for anything the email leaves out
+        title = data.get('title') or 'Meeting'
+        date = data.get('new_date') or datetime.utcnow().strftime('%Y-%m-%d')
         time = data.get('new_time')
         
         # Convert date and time to datetime object
@@ -296,8 +428,8 @@ def schedule_meeting(text, from_email):
             
             return conflict_msg
 
-        attendees = data.get('attendees', [])
-        is_sender_required = data.get('is_sender_required', False)
+        attendees = data.get('attendees') or []
+        is_sender_required = data.get('is_sender_required') or False
 
         # Validate and process attendees
         valid_attendees = set()
@@ -322,22 +454,20 @@ def schedule_meeting(text, from_email):
             logger.info(f"No valid attendees provided. Using default authorized user email: {authorized_user_email}")
 
         # Insert meeting into the database
-        conn = sqlite3.connect('scheduler.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO meetings (title, date, time, attendees, status)
-            VALUES (?, ?, ?, ?, 'scheduled')
-        ''', (title, date, time, ','.join(valid_attendees)))
-        conn.commit()
-        meeting_id = cursor.lastrowid
-        conn.close()
+        with db.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO meetings (title, date, time, attendees, status)
+                VALUES (?, ?, ?, ?, 'scheduled')
+            ''', (title, date, time, ','.join(valid_attendees)))
+            meeting_id = cursor.lastrowid
 
         # Create calendar event
         calendar_response = create_google_calendar_event(creds, title, date, time, valid_attendees)
 
         if "Event created successfully" in calendar_response:
             # Send acknowledgment email
-            service = build('gmail', 'v1', credentials=creds)
+            service = get_service('gmail', 'v1', creds)
             send_calendar_invitation(service, from_email, {
                 'summary': title,
                 'start': {'dateTime': f"{date}T{time}:00"},
@@ -377,19 +507,17 @@ def reschedule_meeting(text, creds, from_email):
         # print(title, old_date, old_time, new_date, new_time)
         
         # Check if meeting exists
-        conn = sqlite3.connect('scheduler.db')
-        cursor = conn.cursor()
+        cursor = db.reader().cursor()
         cursor.execute('''
             SELECT * FROM meetings 
             WHERE title = ? AND date = ? AND time = ? AND status IN ('scheduled', 'rescheduled', 'canceled',"pending")
         ''', (title, old_date, old_time))
         meeting = cursor.fetchone()
         if not meeting:
-            conn.close()
             logger.warning(f"Meeting with title '{title}' on {old_date} at {old_time} does not exist.")
             return f"Meeting with title '{title}' on {old_date} at {old_time} does not exist. No email sent."
-        attendees = data.get('attendees', [])
-        is_sender_required = data.get('is_sender_required', False)
+        attendees = data.get('attendees') or []
+        is_sender_required = data.get('is_sender_required') or False
 
         # Validate and process attendees
         valid_attendees = set()
@@ -414,14 +542,13 @@ def reschedule_meeting(text, creds, from_email):
             logger.info(f"No valid attendees provided. Using default authorized user email: {authorized_user_email}")
 
         # Update the meeting in the database
-        cursor.execute('''
-            UPDATE meetings
-            SET date = ?, time = ?, status = 'rescheduled'
-            WHERE id = ?
-        ''', (new_date, new_time, meeting[0]))
-        conn.commit()
-        meeting_id = cursor.lastrowid
-        conn.close()
+        with db.writer() as conn:
+            conn.execute('''
+                UPDATE meetings
+                SET date = ?, time = ?, status = 'rescheduled'
+                WHERE id = ?
+            ''', (new_date, new_time, meeting[0]))
+        meeting_id = meeting[0]
 
         
         event = {
@@ -435,7 +562,7 @@ def reschedule_meeting(text, creds, from_email):
 
         if "Event created successfully" in calendar_response:
             # Send acknowledgment email
-            service = build('gmail', 'v1', credentials=creds)
+            service = get_service('gmail', 'v1', creds)
             send_calendar_invitation(service, from_email, event, meeting_id)
             return f"Meeting '{title}' scheduled on {new_date} at {new_time} with attendees: {list(valid_attendees)}. {calendar_response}"
         else:
@@ -449,7 +576,7 @@ def reschedule_meeting(text, creds, from_email):
 def delete_calendar_event(date, time,creds):
     try:
         # Get credentials and build service
-        service = build('calendar', 'v3', credentials=creds)
+        service = get_service('calendar', 'v3', creds)
         
         # Calculate time range for search (within a minute of specified time)
         start_time = f"{date}T{time}:00Z"
@@ -477,7 +604,7 @@ def delete_calendar_event(date, time,creds):
             calendarId='primary',
             eventId=event['id']
         ).execute()
-       
+        get_calendar_index().invalidate()
         
         logger.info(f"Event on {date} at {time} has been deleted")
         return f"Successfully deleted event on {date} at {time}"
@@ -492,14 +619,11 @@ def delete_calendar_event(date, time,creds):
 @ray.remote
 def learn_from_feedback(meeting_id, rating, comments):
     try:
-        conn = sqlite3.connect('scheduler.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO feedback (meeting_id, rating, comments)
-            VALUES (?, ?, ?)
-        ''', (meeting_id, rating, comments))
-        conn.commit()
-        conn.close()
+        with db.writer() as conn:
+            conn.execute('''
+                INSERT INTO feedback (meeting_id, rating, comments)
+                VALUES (?, ?, ?)
+            ''', (meeting_id, rating, comments))
         
         # Placeholder for learning logic
         # Future implementation can adjust preferences based on feedback
@@ -511,61 +635,6 @@ def learn_from_feedback(meeting_id, rating, comments):
 
 
 
-@ray.remote
-def email_handler(): 
-    """Monitors Gmail inbox for new scheduling emails based on history ID."""
-    global LATEST_HISTORY_ID
-    try:
-        print("Email Handler")
-        creds = None
-        if os.path.exists('token.json'):
-            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                if not os.path.exists('credentials.json'):
-                    logger.error("credentials.json file not found.")
-                    return "credentials.json file not found."
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    'credentials.json', SCOPES)
-                creds = flow.run_local_server(port=0)
-            with open('token.json', 'w') as token:
-                token.write(creds.to_json())
-
-        service = build('gmail', 'v1', credentials=creds)
-
-        # Check if history ID is initialized
-        if not LATEST_HISTORY_ID:
-            logger.error("History ID not initialized. Run initialize_history_id first.")
-            return "History ID not initialized."
-
-        # Fetch new messages based on history ID
-        results = service.users().history().list(
-            userId='me',
-            startHistoryId=LATEST_HISTORY_ID
-        ).execute()
-
-        changes = results.get('history', [])
-        if not changes:
-            logger.info("No new emails since the last check.")
-            return "No new emails."
-
-        for change in changes:
-            messages = change.get('messages', [])
-            for message in messages:
-                msg_id = message['id']
-                process_email(service, msg_id)
-
-        # Update the latest history ID
-        if 'historyId' in results:
-            LATEST_HISTORY_ID = results['historyId']
-
-        return "Processed new emails."
-    except Exception as e:
-        logger.error(f"Error in email_handler: {e}")
-        return f"Error in email_handler: {str(e)}. No email sent."
-
 def send_email(subject, to_email, body, service):
     """Sends an email response."""
     try:
@@ -584,46 +653,6 @@ def send_email(subject, to_email, body, service):
         
         
 
-def initialize_history_id(service):
-    """Initialize the history ID when the server starts."""
-    global LATEST_HISTORY_ID
-    try:
-        print("Initializing history ID")
-        # Get the current profile's history ID
-        profile = service.users().getProfile(userId='me').execute()
-        LATEST_HISTORY_ID = profile.get('historyId')
-        logger.info(f"Initialized latest history ID: {LATEST_HISTORY_ID}")
-    except Exception as e:
-        logger.error(f"Error initializing history ID: {e}")
-
-
-def fetch_new_emails(service):
-    """Fetch new emails using Gmail history API."""
-    global LATEST_HISTORY_ID
-    try:
-        print("Fetching new emails")
-        if not LATEST_HISTORY_ID:
-            logger.error("History ID not initialized.")
-            return
-
-        # Fetch new messages based on history ID
-        results = service.users().history().list(
-            userId='me', startHistoryId=LATEST_HISTORY_ID
-        ).execute()
-
-        changes = results.get('history', [])
-        for change in changes:
-            messages = change.get('messages', [])
-            for message in messages:
-                msg_id = message['id']
-                process_email(service, msg_id)
-
-        # Update the latest history ID
-        if 'historyId' in results:
-            LATEST_HISTORY_ID = results['historyId']
-    except Exception as e:
-        logger.error(f"Error fetching new emails: {e}")
-
 # def process_email(service, msg_id):
 #     """Process a single email by ID."""
 #     try:
@@ -678,124 +707,175 @@ def fetch_new_emails(service):
 #         logger.error(f"Error processing email: {e}")
 
 
-# Initialize sentiment analysis pipeline
-sentiment_pipeline = pipeline("sentiment-analysis")
+def sentiment_priority(email_text, sentiment_result):
+    """Turn a model label/score into the stored sentiment fields and priority."""
+    label = sentiment_result['label']
+    score = sentiment_result['score']
+    
+    # Define urgency keywords
+    urgency_keywords = ["urgent", "ASAP", "immediately", "deadline", "important", "critical"]
+    
+    # Determine priority
+    priority = "Medium Priority"
+    if any(word in email_text.lower() for word in urgency_keywords):
+        priority = "High Priority - Urgent"
+    elif label == "NEGATIVE" and score > 0.75:
+        priority = "High Priority - Negative"
+    elif label == "POSITIVE" and score > 0.75:
+        priority = "Low Priority - Positive"
+    
+    return {
+        "sentiment": label,
+        "confidence": score,
+        "priority": priority
+    }
 
-def analyze_email_sentiment(email_text):
-    """Analyze the sentiment and priority of an email."""
+async def aanalyze_email_sentiment(email_text):
     try:
-        # Get sentiment result
-        sentiment_result = sentiment_pipeline(email_text)[0]
-        label = sentiment_result['label']
-        score = sentiment_result['score']
-        
-        # Define urgency keywords
-        urgency_keywords = ["urgent", "ASAP", "immediately", "deadline", "important", "critical"]
-        
-        # Determine priority
-        priority = "Medium Priority"
-        if any(word in email_text.lower() for word in urgency_keywords):
-            priority = "High Priority - Urgent"
-        elif label == "NEGATIVE" and score > 0.75:
-            priority = "High Priority - Negative"
-        elif label == "POSITIVE" and score > 0.75:
-            priority = "Low Priority - Positive"
-        
-        return {
-            "sentiment": label,
-            "confidence": score,
-            "priority": priority
-        }
+        # The first lookup of an actor is a blocking call into Ray
+        model = await asyncio.to_thread(get_sentiment_model)
+        sentiment_result = await model.analyze.remote(email_text)
+        return sentiment_priority(email_text, sentiment_result)
     except Exception as e:
         logger.error(f"Error analyzing email sentiment: {e}")
         return None
 
-# Modify the process_email function to include sentiment analysis
-def process_email(service, msg_id):
-    """Process a single email by ID."""
-    try:
-        print("Processing email")
-        conn = sqlite3.connect('scheduler.db')
-        cursor = conn.cursor()
-        
-        # Create sentiment_analysis table if it doesn't exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sentiment_analysis (
-                msg_id TEXT PRIMARY KEY,
-                subject TEXT,
-                body TEXT,
-                sentiment TEXT,
-                confidence REAL,
-                priority TEXT,
-                processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('SELECT id FROM processed_emails WHERE msg_id = ?', (msg_id,))
-        if cursor.fetchone():
-            logger.info(f"Email {msg_id} has already been processed. Skipping.")
-            conn.close()
-            return
-
-        message = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-        payload = message.get('payload', {})
-        headers = payload.get('headers', [])
-        subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), "")
-        from_email = next((h['value'] for h in headers if h['name'].lower() == 'from'), "")
-        from_email = re.search(r'<(.+?)>', from_email)
-        from_email = from_email.group(1) if from_email else from_email
-
-        # Extract the email body
-        body = ""
-        if 'parts' in payload:
-            for part in payload['parts']:
-                if part.get('mimeType') == 'text/plain':
-                    data = part['body'].get('data', '')
-                    if data:
-                        decoded_data = base64.urlsafe_b64decode(data).decode('utf-8')
-                        body += decoded_data
-        else:
-            data = payload['body'].get('data', '')
-            if data:
-                decoded_data = base64.urlsafe_b64decode(data).decode('utf-8')
-                body += decoded_data
+async def analyze_email(body, from_email, msg_id):
+    """
+    Run the per-email stages as a small DAG once the body is decoded:
+    sentiment runs alongside extraction, and scheduling runs once both are
+    done. Returns (sentiment_result, tasks, schedule_response); raises
+    RuntimeError if sentiment or task extraction failed, so the email stays
+    unprocessed and is retried.
+    """
+    sentiment = asyncio.ensure_future(aanalyze_email_sentiment(body))
+
+    # One model call for both tasks and meeting details, unless disabled or it fails
+    insights = None
+    if EXTRACTION_MODE == 'combined':
+        insights = await aextract_email_insights(body, from_email)
+
+    if insights is not None:
+        tasks = validate_tasks(insights['tasks'])
+        meeting = json.dumps({key: insights[key] for key in MEETING_FIELDS if insights[key] is not None})
+    else:
+        tasks, meeting = await asyncio.gather(
+            aanalyze_email_for_tasks(body, msg_id),
+            aparse_natural_language(body, from_email)
+        )
+
+    sentiment_result = await sentiment
+    if sentiment_result is None or tasks is None:
+        raise RuntimeError(f"Analysis of email {msg_id} failed")
+
+    # Scheduling creates events and sends invitations, so it waits until the
+    # email is sure not to be retried for a failed analysis
+    schedule_response = await asyncio.to_thread(handle_schedule_request, body, from_email, meeting)
+    return sentiment_result, tasks, schedule_response
+
+def decode_message(msg_id, message):
+    """Pull the subject, sender address and plain text body out of a Gmail message resource."""
+    body = extract_text(message.get('payload', {}))
+    if not body:
+        body = "No content found in the email body."
+    return {
+        'msg_id': msg_id,
+        'thread_id': message.get('threadId'),
+        'internal_date': internal_date(message),
+        'subject': header(message, 'Subject'),
+        'from_email': sender_address(header(message, 'From')),
+        'body': body
+    }
+
+
+def analyze_decoded_email(email):
+    """Run the sentiment, task and scheduling analysis of a decoded email."""
+    logger.info(f"Processing email from {email['from_email']} with subject '{email['subject']}'.")
+    # On a loop of this worker's own: the LLM client's loop is shared by every call in flight
+    sentiment_result, tasks, response_message = asyncio.run(
+        analyze_email(email['body'], email['from_email'], email['msg_id'])
+    )
+    logger.info(response_message)
+    return {**email, 'sentiment': sentiment_result, 'tasks': tasks}
 
-        if not body:
-            body = "No content found in the email body."
 
-        # Perform sentiment analysis
-        sentiment_result = analyze_email_sentiment(body)
+def persist_email(email):
+    """Commit everything about an analyzed email, including the processed marker, together."""
+    msg_id, body = email['msg_id'], email['body']
+    sentiment_result, tasks = email['sentiment'], email['tasks']
+    with db.writer() as conn:
+        cursor = conn.cursor()
         if sentiment_result:
             cursor.execute('''
-                INSERT INTO sentiment_analysis (msg_id, sentiment, confidence, priority,subject,body)
-                VALUES (?, ?, ?, ?, ?, ?)
+                INSERT INTO sentiment_analysis (msg_id, sentiment, confidence, priority, subject, body_z, snippet)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (msg_id, sentiment_result['sentiment'], sentiment_result['confidence'], 
-                 sentiment_result['priority'],subject, body))
-        
-        print("reached tasks")
-
-        tasks = analyze_email_for_tasks(body, msg_id)
-        print(tasks)
+                 sentiment_result['priority'], email['subject'], compress_body(body), make_snippet(body)))
         if tasks:
             store_tasks(tasks, msg_id, conn)
             logger.info(f"Stored {len(tasks)} tasks from email {msg_id}")
 
-        logger.info(f"Processing email from {from_email} with subject '{subject}'.")
-        response_message = ray.get(schedule_meeting.remote(body, from_email))
+        # Mark the email as processed
+        cursor.execute(
+            'INSERT INTO processed_emails (msg_id, thread_id, internal_date) VALUES (?, ?, ?)',
+            (msg_id, email.get('thread_id'), email.get('internal_date'))
+        )
+        cursor.execute('DELETE FROM failed_emails WHERE msg_id = ?', (msg_id,))
+    get_processed_messages().add(msg_id)
+
+
+def handled_threads(thread_ids) -> dict:
+    """Internal date of the earliest message processed or skipped in each of the given threads that has one."""
+    thread_ids = list({thread_id for thread_id in thread_ids if thread_id})
+    if not thread_ids:
+        return {}
+    rows = db.query(
+        f"SELECT thread_id, MIN(internal_date) FROM processed_emails "
+        f"WHERE thread_id IN ({','.join('?' * len(thread_ids))}) AND internal_date IS NOT NULL GROUP BY thread_id",
+        thread_ids
+    )
+    return {thread_id: handled_at for thread_id, handled_at in rows}
+
+
+def retrying(msg_ids) -> set:
+    """The given msg_ids that failed before and are being retried."""
+    msg_ids = list(msg_ids)
+    if not msg_ids:
+        return set()
+    rows = db.query(f"SELECT msg_id FROM failed_emails WHERE msg_id IN ({','.join('?' * len(msg_ids))})", msg_ids)
+    return {row[0] for row in rows}
+
+
+def mark_skipped(messages):
+    """Record messages triage ruled out as processed, so they are never fetched in full."""
+    if not messages:
+        return
+    with db.writer() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO processed_emails (msg_id, thread_id, internal_date) VALUES (?, ?, ?)',
+            [(message['id'], message.get('threadId'), internal_date(message)) for message in messages]
+        )
+    processed = get_processed_messages()
+    for message in messages:
+        processed.add(message['id'])
 
-        logger.info(response_message)
 
-        # Mark the email as processed
-        cursor.execute('INSERT INTO processed_emails (msg_id) VALUES (?)', (msg_id,))
-        conn.commit()
-        conn.close()
+def record_failure(msg_id, error) -> int:
+    """Count a failed attempt at processing msg_id; returns the attempts so far."""
+    with db.writer() as conn:
+        conn.execute('''
+            INSERT INTO failed_emails (msg_id, attempts, last_error) VALUES (?, 1, ?)
+            ON CONFLICT(msg_id) DO UPDATE SET
+                attempts = attempts + 1,
+                last_error = excluded.last_error,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (msg_id, str(error)))
+        return conn.execute('SELECT attempts FROM failed_emails WHERE msg_id = ?', (msg_id,)).fetchone()[0]
 
-    except Exception as e:
-        logger.error(f"Error processing email: {e}")
 
 def create_event(creds, title, date, time, attendees):
     try:
-        service = build('calendar', 'v3', credentials=creds)
+        service = get_service('calendar', 'v3', creds)
         start_datetime = f"{date}T{time}:00"
         end_time = (datetime.strptime(start_datetime, "%Y-%m-%dT%H:%M:%S") + timedelta(hours=1)).strftime("%H:%M:%S")
         end_datetime = f"{date}T{end_time}"
@@ -813,6 +893,7 @@ def create_event(creds, title, date, time, attendees):
             'attendees': [{'email': attendee} for attendee in attendees],
         }
         created_event = service.events().insert(calendarId='primary', body=event).execute()
+        get_calendar_index().invalidate()
         logger.info(f"Event created: {created_event.get('htmlLink')}")
         return f"Event created successfully: {created_event.get('htmlLink')}"
     except HttpError as error:
@@ -820,8 +901,30 @@ def create_event(creds, title, date, time, attendees):
         logger.error(f"An error occurred while creating the event: {error_content}")
         return f"Failed to create the event in Google Calendar. Error: {error_content}"
         
-def analyze_email_for_tasks(email_body: str, msg_id: str) -> List[dict]:
-    """Analyze email content using OpenAI to extract tasks."""
+def validate_tasks(tasks) -> List[dict]:
+    """Keep only well-formed task dicts from a model response."""
+    # Validate task structure
+    if not isinstance(tasks, list):
+        logger.warning("OpenAI response is not a list")
+        return []
+        
+    valid_tasks = []
+    assignees = ["Tabish Shaikh", "Riva Rodrigues", "Nirmitee Sarode"]
+    for task in tasks:
+        if all(key in task for key in ["title", "project", "assignee", "dueDate", "status"]):
+            # Ensure assignee is a list
+            if isinstance(task["assignee"], str):
+                task["assignee"] = [task["assignee"]]
+            # Assign one of the predefined names
+            task["assignee"] = [assignees[0]]
+            valid_tasks.append(task)
+        else:
+            logger.warning(f"Skipping invalid task structure: {task}")
+            
+    return valid_tasks
+
+async def aanalyze_email_for_tasks(email_body: str, msg_id: str) -> Optional[List[dict]]:
+    """Analyze email content using OpenAI to extract tasks; returns None if extraction failed."""
     try:
         prompt = f"""
         Extract actionable tasks from the email content below.
@@ -850,54 +953,45 @@ def analyze_email_for_tasks(email_body: str, msg_id: str) -> List[dict]:
         {email_body}
         """
 
-        response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a task extraction AI that ONLY returns valid JSON arrays."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=1000
-        )
-
-        content = response.choices[0].message.content.strip()
-        
-        # Remove any markdown formatting
-        if content.startswith("```json"):
-            content = content[7:-3] if content.endswith("```") else content[7:]
+        cache = get_llm_cache()
+        cache_key = cache.key("gpt-4", TASKS_PROMPT_VERSION, email_body)
+        content = await asyncio.to_thread(cache.get, cache_key)
+        cached = content is not None
+
+        if not cached:
+            content = await get_llm_client().complete(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": "You are a task extraction AI that ONLY returns valid JSON arrays."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3,
+                max_tokens=1000
+            )
+            
+            # Remove any markdown formatting
+            if content.startswith("```json"):
+                content = content[7:-3] if content.endswith("```") else content[7:]
         
         # Validate and parse JSON
         tasks = json.loads(content)
+        if not cached:
+            await asyncio.to_thread(cache.put, cache_key, "gpt-4", content, TASKS_CACHE_TTL)
         
-        # Validate task structure
-        if not isinstance(tasks, list):
-            logger.warning("OpenAI response is not a list")
-            return []
-            
-        valid_tasks = []
-        assignees = ["Tabish Shaikh", "Riva Rodrigues", "Nirmitee Sarode"]
-        for task in tasks:
-            if all(key in task for key in ["title", "project", "assignee", "dueDate", "status"]):
-                # Ensure assignee is a list
-                if isinstance(task["assignee"], str):
-                    task["assignee"] = [task["assignee"]]
-                # Assign one of the predefined names
-                task["assignee"] = [assignees[0]]
-                valid_tasks.append(task)
-            else:
-                logger.warning(f"Skipping invalid task structure: {task}")
-                
-        return valid_tasks
+        return validate_tasks(tasks)
 
     except json.JSONDecodeError as e:
         logger.error(f"Error decoding JSON from OpenAI response: {e}\nResponse content: {content}")
-        return []
+        return None
     except Exception as e:
         logger.error(f"Error analyzing tasks: {e}")
-        return []
+        return None
+
+def analyze_email_for_tasks(email_body: str, msg_id: str) -> Optional[List[dict]]:
+    return get_llm_client().run(aanalyze_email_for_tasks(email_body, msg_id))
 
 def store_tasks(tasks: List[dict], msg_id: str, conn: sqlite3.Connection):
-    """Store tasks in the database."""
+    """Store tasks in the database; the caller commits."""
     try:
         cursor = conn.cursor()
         for task in tasks:
@@ -913,6 +1007,5 @@ def store_tasks(tasks: List[dict], msg_id: str, conn: sqlite3.Connection):
                 task['dueDate'],
                 task['status']
             ))
-        conn.commit()
     except Exception as e:
         logger.error(f"Error storing tasks: {e}")
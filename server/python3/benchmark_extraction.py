@@ -0,0 +1,78 @@
+import argparse
+import json
+import statistics
+import time
+
+import agents
+from agents import analyze_decoded_email, parse_natural_language
+from llm_cache import get_llm_cache
+
+SAMPLE_EMAILS = [
+    "Hi, can we schedule a project sync tomorrow at 15:00 with ravi@example.com? "
+    "Also please send me the Q3 budget draft by Friday.",
+    "Reminder: the design review moved to next Monday at 10:30. "
+    "Nirmitee, please update the onboarding mockups before then.",
+    "Thanks for the update! No action needed on my side.",
+]
+
+
+def dry_run_schedule(text, from_email, parsed=None):
+    """handle_schedule_request up to its model call; everything after that writes to the calendar and sends mail."""
+    if parsed is None:
+        parsed = parse_natural_language(text, from_email)
+    return parsed
+
+
+def email_path(mode):
+    """The per-email analysis the ingestion pipeline runs, in the given extraction mode."""
+    def analyze(body, sender):
+        agents.EXTRACTION_MODE = mode
+        analyze_decoded_email({'msg_id': 'benchmark', 'subject': '', 'from_email': sender, 'body': body})
+    return analyze
+
+
+def measure(path, emails, sender, rounds):
+    # Untimed: the first email also pays for client and sentiment actor start-up
+    path(emails[0], sender)
+    latencies = []
+    for _ in range(rounds):
+        for body in emails:
+            started = time.perf_counter()
+            path(body, sender)
+            latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {
+        "emails": len(latencies),
+        "mean_s": statistics.mean(latencies),
+        "p50_s": latencies[len(latencies) // 2],
+        "p95_s": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare per-email analysis latency with separate and combined LLM extraction."
+    )
+    parser.add_argument("--emails", help="JSON file with a list of email bodies (defaults to built-in samples)")
+    parser.add_argument("--sender", default="sender@example.com")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    emails = SAMPLE_EMAILS
+    if args.emails:
+        with open(args.emails) as f:
+            emails = json.load(f)
+
+    # Measure the model round trips, not cache hits
+    get_llm_cache().enabled = False
+    agents.handle_schedule_request = dry_run_schedule
+
+    results = {
+        "separate": measure(email_path('separate'), emails, args.sender, args.rounds),
+        "combined": measure(email_path('combined'), emails, args.sender, args.rounds),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+import db
+from body_store import compress_body, make_snippet
+from listing import ASSIGNEE_NAMES, SENTIMENT_FIELDS, TASK_FIELDS, sentiment_page, tasks_page
+from migrations import migrate
+
+
+# The models and row handling the list endpoints used before rendering moved into SQLite
+class Task(BaseModel):
+    title: str
+    project: str
+    assignee: List[str]
+    dueDate: str
+    status: str
+    created_at: datetime
+
+
+class SentimentAnalysis(BaseModel):
+    msg_id: str
+    sentiment: Optional[str] = None
+    confidence: Optional[float] = None
+    priority: Optional[str] = None
+    processed_at: datetime
+    subject: Optional[str] = None
+    snippet: Optional[str] = None
+
+
+def render(items):
+    """What JSONResponse does with the encoded models."""
+    return json.dumps(
+        jsonable_encoder([item.dict() for item in items]), ensure_ascii=False, separators=(",", ":")
+    ).encode('utf-8')
+
+
+def model_tasks(limit):
+    rows = db.query('''
+        SELECT id, msg_id, title, project, assignee, due_date, status, created_at
+        FROM tasks ORDER BY created_at DESC, id DESC LIMIT ?
+    ''', (limit,))
+    return render([
+        Task(
+            title=row[2], project=row[3], assignee=[random.choice(ASSIGNEE_NAMES)],
+            dueDate=row[5], status=row[6], created_at=datetime.fromisoformat(row[7])
+        )
+        for row in rows
+    ])
+
+
+def model_sentiment(limit):
+    rows = db.query(f'''
+        SELECT {', '.join(SENTIMENT_FIELDS)} FROM sentiment_analysis
+        ORDER BY processed_at DESC, msg_id DESC LIMIT ?
+    ''', (limit,))
+    items = []
+    for row in rows:
+        values = dict(zip(SENTIMENT_FIELDS, row))
+        values["processed_at"] = datetime.fromisoformat(values["processed_at"])
+        items.append(SentimentAnalysis(**values))
+    return render(items)
+
+
+def sql_tasks(limit):
+    return tasks_page('', [], limit, TASK_FIELDS)[0]
+
+
+def sql_sentiment(limit):
+    return sentiment_page('', [], limit, SENTIMENT_FIELDS)[0]
+
+
+def populate(rows):
+    start = datetime(2024, 1, 1)
+    with db.writer() as conn:
+        conn.executemany(
+            'INSERT INTO tasks (msg_id, title, project, assignee, due_date, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [
+                (f'm{i}', f'Task {i}', 'Apollo', 'Riva', '2024-12-31', 'Not started',
+                 (start + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S'))
+                for i in range(rows)
+            ]
+        )
+        body = "Hi team, please review the attached budget draft before Friday's sync. " * 10
+        conn.executemany(
+            '''INSERT INTO sentiment_analysis
+               (msg_id, subject, body_z, snippet, sentiment, confidence, priority, processed_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            [
+                (f'm{i}', f'Budget review {i}', compress_body(body), make_snippet(body), 'POSITIVE',
+                 random.random(), 'Low', (start + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S'))
+                for i in range(rows)
+            ]
+        )
+
+
+def measure(path, limit, rounds):
+    latencies = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        body = path(limit)
+        latencies.append(time.perf_counter() - started)
+    return {"mean_s": statistics.mean(latencies), "min_s": min(latencies), "bytes": len(body)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare model-based and SQLite-rendered JSON for the list endpoints.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        db.DB_PATH = os.path.join(directory, 'benchmark.db')
+        migrate()
+        populate(max(args.sizes))
+        for size in args.sizes:
+            results[size] = {
+                "tasks_models": measure(model_tasks, size, args.rounds),
+                "tasks_sqlite": measure(sql_tasks, size, args.rounds),
+                "sentiment_models": measure(model_sentiment, size, args.rounds),
+                "sentiment_sqlite": measure(sql_sentiment, size, args.rounds),
+                # Task assignees are drawn at random, so only the sentiment output can be compared
+                "sentiment_identical": model_sentiment(size) == sql_sentiment(size),
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
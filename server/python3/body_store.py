@@ -0,0 +1,28 @@
+import zlib
+from typing import Optional
+
+# Characters of the body kept uncompressed for list views
+SNIPPET_LENGTH = 200
+COMPRESSION_LEVEL = 6
+
+
+def compress_body(body: Optional[str]) -> Optional[bytes]:
+    if body is None:
+        return None
+    return zlib.compress(body.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def decompress_body(body_z: Optional[bytes]) -> Optional[str]:
+    if body_z is None:
+        return None
+    return zlib.decompress(body_z).decode('utf-8')
+
+
+def make_snippet(body: Optional[str], length: int = SNIPPET_LENGTH) -> Optional[str]:
+    """First length characters of the body with whitespace collapsed, ending in an ellipsis if cut."""
+    if body is None:
+        return None
+    text = ' '.join(body.split())
+    if len(text) <= length:
+        return text
+    return text[:length - 1].rstrip() + '…'
@@ -0,0 +1,212 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import List
+
+import pytz
+from googleapiclient.errors import HttpError
+
+import db
+from google_clients import get_service
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of seconds between two incremental syncs against Google
+SYNC_INTERVAL = float(os.getenv('CALENDAR_SYNC_INTERVAL', '30'))
+
+
+def parse_event_time(value: dict) -> datetime:
+    """Convert a Calendar API start/end object to a UTC-aware datetime."""
+    raw = value.get('dateTime', value.get('date'))
+    parsed = datetime.fromisoformat(raw.replace('Z', '+00:00'))
+    if not parsed.tzinfo:
+        parsed = parsed.replace(tzinfo=pytz.UTC)
+    return parsed
+
+
+class CalendarIndex:
+    """
+    Local interval index of a Google Calendar.
+
+    Events are persisted in the calendar_events table and mirrored in memory
+    as a list sorted by start time, so conflict checks are plain overlap
+    queries. The mirror is kept current with incremental events.list calls
+    using sync tokens; a 410 Gone from Google triggers a full resync.
+    """
+
+    def __init__(self, calendar_id='primary'):
+        self.calendar_id = calendar_id
+        self._lock = threading.Lock()
+        self._starts = []
+        self._events = []
+        self._max_duration = 0.0
+        self._version = None
+        self._last_sync = 0.0
+
+    def invalidate(self):
+        """Force an incremental sync before the next query, e.g. after we changed the calendar."""
+        with self._lock:
+            self._last_sync = 0.0
+
+    def refresh(self, creds, force=False):
+        """Bring the index up to date, talking to Google at most once per SYNC_INTERVAL."""
+        with self._lock:
+            cursor = db.reader().cursor()
+            cursor.execute(
+                'SELECT sync_token, version FROM calendar_sync WHERE calendar_id = ?',
+                (self.calendar_id,)
+            )
+            row = cursor.fetchone()
+            sync_token, version = row if row else (None, 0)
+
+            # Another process may have synced since we last loaded
+            if version != self._version:
+                self._load(cursor)
+                self._version = version
+
+            if not force and sync_token and time.monotonic() - self._last_sync < SYNC_INTERVAL:
+                return
+
+            # Talk to Google before taking the write lock
+            service = get_service('calendar', 'v3', creds)
+            try:
+                events, next_token = self._fetch(service, sync_token)
+            except HttpError as error:
+                if error.resp.status != 410:
+                    raise
+                logger.info("Calendar sync token expired, running a full resync.")
+                sync_token = None
+                events, next_token = self._fetch(service, None)
+
+            with db.writer() as conn:
+                changed = self._store(conn.cursor(), events, next_token, full=not sync_token)
+
+            # An empty incremental sync only moves the token; the mirror is still current
+            if changed:
+                self._load(cursor)
+                cursor.execute(
+                    'SELECT version FROM calendar_sync WHERE calendar_id = ?',
+                    (self.calendar_id,)
+                )
+                self._version = cursor.fetchone()[0]
+            self._last_sync = time.monotonic()
+
+    def _fetch(self, service, sync_token):
+        """Pull changes since sync_token (or everything, without one); returns (events, next sync token)."""
+        events = []
+        page_token = None
+        while True:
+            params = {
+                'calendarId': self.calendar_id,
+                'singleEvents': True,
+                'maxResults': 2500,
+            }
+            if sync_token:
+                params['syncToken'] = sync_token
+            if page_token:
+                params['pageToken'] = page_token
+
+            events_result = service.events().list(**params).execute()
+            events.extend(events_result.get('items', []))
+
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                return events, events_result.get('nextSyncToken')
+
+    def _store(self, cursor, events, sync_token, full):
+        """
+        Apply fetched events to the table and record the new sync token. The
+        version only moves when the events did; returns whether they did.
+        """
+        if not full and not events:
+            cursor.execute('''
+                UPDATE calendar_sync SET sync_token = ?, synced_at = CURRENT_TIMESTAMP
+                WHERE calendar_id = ?
+            ''', (sync_token, self.calendar_id))
+            return False
+
+        if full:
+            cursor.execute('DELETE FROM calendar_events WHERE calendar_id = ?', (self.calendar_id,))
+        for event in events:
+            self._apply(cursor, event)
+
+        cursor.execute('''
+            INSERT INTO calendar_sync (calendar_id, sync_token, version, synced_at)
+            VALUES (?, ?, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT(calendar_id) DO UPDATE SET
+                sync_token = excluded.sync_token,
+                version = calendar_sync.version + 1,
+                synced_at = excluded.synced_at
+        ''', (self.calendar_id, sync_token))
+        return True
+
+    def _apply(self, cursor, event):
+        if event.get('status') == 'cancelled' or 'start' not in event:
+            cursor.execute(
+                'DELETE FROM calendar_events WHERE calendar_id = ? AND event_id = ?',
+                (self.calendar_id, event['id'])
+            )
+            return
+
+        cursor.execute('''
+            INSERT OR REPLACE INTO calendar_events
+            (event_id, calendar_id, summary, start_ts, end_ts, attendees)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            event['id'],
+            self.calendar_id,
+            event.get('summary', '(No title)'),
+            parse_event_time(event['start']).timestamp(),
+            parse_event_time(event['end']).timestamp(),
+            json.dumps(event.get('attendees', []))
+        ))
+
+    def _load(self, cursor):
+        cursor.execute('''
+            SELECT summary, start_ts, end_ts, attendees
+            FROM calendar_events
+            WHERE calendar_id = ?
+            ORDER BY start_ts
+        ''', (self.calendar_id,))
+        rows = cursor.fetchall()
+        self._starts = [row[1] for row in rows]
+        self._events = rows
+        self._max_duration = max((row[2] - row[1] for row in rows), default=0.0)
+
+    def overlapping(self, start: datetime, end: datetime) -> List[dict]:
+        """Return indexed events that overlap [start, end] (inclusive at both ends)."""
+        start_ts = start.timestamp()
+        end_ts = end.timestamp()
+        with self._lock:
+            # No event is longer than _max_duration, so nothing starting earlier can overlap
+            lo = bisect.bisect_left(self._starts, start_ts - self._max_duration)
+            hi = bisect.bisect_right(self._starts, end_ts)
+            candidates = self._events[lo:hi]
+
+        return [
+            {
+                'summary': summary,
+                'start': datetime.fromtimestamp(event_start, tz=pytz.UTC),
+                'end': datetime.fromtimestamp(event_end, tz=pytz.UTC),
+                'attendees': json.loads(attendees) if attendees else []
+            }
+            for summary, event_start, event_end, attendees in candidates
+            if event_end >= start_ts
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_calendar_index() -> CalendarIndex:
+    """Return the process-wide index of the primary calendar."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CalendarIndex()
+        return _index
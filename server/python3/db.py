@@ -0,0 +1,126 @@
+import asyncio
+import functools
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from body_store import decompress_body
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv('SCHEDULER_DB_PATH', 'scheduler.db')
+# How long a connection waits on a lock held by another process before failing
+BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+# Prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 256
+# Threads that run database calls for async request handlers
+POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', '8'))
+
+_local = threading.local()
+_writer = None
+_writer_lock = threading.RLock()
+_writer_depth = 0
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def connect(path=None) -> sqlite3.Connection:
+    """
+    Open a configured connection: WAL journal, synchronous=NORMAL, busy timeout,
+    a prepared statement cache and the decompress_body() SQL function. Connections run in autocommit mode;
+    transactions are opened explicitly by writer().
+    """
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    # Lets queries return full bodies from the compressed column
+    conn.create_function('decompress_body', 1, decompress_body, deterministic=True)
+    return conn
+
+
+def reader() -> sqlite3.Connection:
+    """Return the calling thread's read connection, opening it on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = connect()
+    return conn
+
+
+@contextmanager
+def writer():
+    """
+    Run a write transaction on the process-wide writer connection.
+
+    Writers are serialized inside the process and take the database write
+    lock up front (BEGIN IMMEDIATE), so they queue on the busy timeout
+    instead of failing mid-transaction. Nested use joins the outer
+    transaction. Commits on success, rolls back on error.
+    """
+    global _writer, _writer_depth
+    with _writer_lock:
+        if _writer is None:
+            _writer = connect()
+
+        if _writer_depth:
+            _writer_depth += 1
+            try:
+                yield _writer
+            finally:
+                _writer_depth -= 1
+            return
+
+        _writer.execute('BEGIN IMMEDIATE')
+        _writer_depth = 1
+        try:
+            yield _writer
+        except BaseException:
+            _writer.execute('ROLLBACK')
+            raise
+        else:
+            _writer.execute('COMMIT')
+        finally:
+            _writer_depth = 0
+
+
+def query(sql, params=()) -> list:
+    """Run a read query on the calling thread's connection and return all rows."""
+    return reader().execute(sql, params).fetchall()
+
+
+def query_one(sql, params=()):
+    """Run a read query on the calling thread's connection and return the first row."""
+    return reader().execute(sql, params).fetchone()
+
+
+def execute(sql, params=()) -> int:
+    """Run one write statement in its own transaction and return the number of rows changed."""
+    with writer() as conn:
+        return conn.execute(sql, params).rowcount
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='db')
+        return _executor
+
+
+async def run(fn, *args, **kwargs):
+    """
+    Await a blocking database function on the database thread pool, so the
+    event loop keeps serving other requests meanwhile. Each pool thread keeps
+    its own read connection.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args, **kwargs))
@@ -0,0 +1,29 @@
+import json
+import os
+from typing import Iterator
+
+import db
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+# Rows pulled from SQLite per fetchmany call while streaming an export
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '500'))
+
+
+def iter_ndjson(query: str, params=(), batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[str]:
+    """
+    Stream the rows of a query as newline-delimited JSON objects keyed by column name.
+
+    Uses its own connection, since the response is iterated from whichever
+    worker thread is free, and only holds one batch of rows at a time.
+    """
+    conn = db.connect()
+    try:
+        cursor = conn.execute(query, params)
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+    finally:
+        conn.close()
@@ -0,0 +1,49 @@
+import logging
+import os
+from typing import Dict, Iterable, List
+
+from googleapiclient.http import BatchHttpRequest
+
+logger = logging.getLogger(__name__)
+
+# Batch endpoint and transport can be pointed at a local fake Gmail server
+BATCH_URI = os.getenv('GMAIL_BATCH_URI', 'https://gmail.googleapis.com/batch/gmail/v1')
+# Gmail accepts at most 100 calls per batch request
+MAX_BATCH_SIZE = 100
+BATCH_SIZE = min(int(os.getenv('GMAIL_BATCH_SIZE', str(MAX_BATCH_SIZE))), MAX_BATCH_SIZE)
+
+
+def unique_ids(msg_ids: Iterable[str]) -> List[str]:
+    """Drop repeated message IDs while keeping the order they arrived in."""
+    return list(dict.fromkeys(msg_ids))
+
+
+def fetch_messages(service, msg_ids: Iterable[str], format='full', http=None,
+                   batch_uri=BATCH_URI, batch_size=BATCH_SIZE, **get_kwargs) -> Dict[str, dict]:
+    """
+    Fetch messages through Gmail batch HTTP requests.
+
+    Returns a dict of msg_id -> message resource. Messages whose part of the
+    batch failed are logged and left out, so callers can fall back to a
+    single messages().get for them. Pass http to use a different transport.
+    """
+    msg_ids = unique_ids(msg_ids)
+    messages = {}
+
+    def on_response(request_id, response, exception):
+        if exception is not None:
+            logger.warning(f"Batch fetch failed for message {request_id}: {exception}")
+            return
+        messages[request_id] = response
+
+    for offset in range(0, len(msg_ids), batch_size):
+        batch = BatchHttpRequest(callback=on_response, batch_uri=batch_uri)
+        for msg_id in msg_ids[offset:offset + batch_size]:
+            batch.add(
+                service.users().messages().get(userId='me', id=msg_id, format=format, **get_kwargs),
+                request_id=msg_id
+            )
+        batch.execute(http=http)
+
+    logger.info(f"Fetched {len(messages)}/{len(msg_ids)} messages in batches of {batch_size}")
+    return messages
@@ -0,0 +1,106 @@
+import base64
+import logging
+import os
+import re
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Headers requested in the metadata phase: what decoding needs plus what triage looks at
+METADATA_HEADERS = ['From', 'Subject', 'List-Unsubscribe', 'List-Id', 'Precedence', 'Auto-Submitted']
+# Characters of text kept from a message body; the models only read the start of it anyway
+MAX_BODY_CHARS = int(os.getenv('GMAIL_MAX_BODY_CHARS', '20000'))
+# Skip messages later than one already processed or skipped in the same thread
+SKIP_SEEN_THREADS = os.getenv('GMAIL_SKIP_SEEN_THREADS', '1') == '1'
+
+NO_REPLY_PATTERN = re.compile(r'^(no[-_.]?reply|do[-_.]?not[-_.]?reply|mailer-daemon|bounces?)([+@-]|$)', re.IGNORECASE)
+BULK_PRECEDENCE = {'bulk', 'list', 'junk'}
+_TAG_PATTERN = re.compile(r'<[^>]+>')
+_INVISIBLE_PATTERN = re.compile(r'<(script|style)\b.*?</\1>', re.IGNORECASE | re.DOTALL)
+
+
+def header(message: dict, name: str) -> str:
+    """Value of the first header called name (case-insensitively), or an empty string."""
+    name = name.lower()
+    headers = message.get('payload', {}).get('headers', [])
+    return next((h['value'] for h in headers if h['name'].lower() == name), "")
+
+
+def sender_address(from_header: str) -> str:
+    match = re.search(r'<(.+?)>', from_header)
+    return (match.group(1) if match else from_header).strip()
+
+
+def internal_date(message: dict) -> Optional[int]:
+    """When Gmail received the message, in ms since the epoch, if the resource says."""
+    value = message.get('internalDate')
+    return int(value) if value else None
+
+
+def skip_reason(message: dict, handled_threads: Optional[Dict[str, int]] = None) -> Optional[str]:
+    """
+    Why a message fetched with format='metadata' is not worth the full fetch
+    and analysis, or None if it is: newsletters and other bulk mail, mail from
+    no-reply senders, and follow-ups in threads already handled.
+    handled_threads maps thread IDs to the internal date of the earliest
+    message handled in them; only messages received after it are follow-ups.
+    """
+    if header(message, 'List-Unsubscribe') or header(message, 'List-Id'):
+        return 'newsletter'
+    if header(message, 'Precedence').strip().lower() in BULK_PRECEDENCE:
+        return 'newsletter'
+    if header(message, 'Auto-Submitted').strip().lower() not in ('', 'no'):
+        return 'no_reply'
+    if NO_REPLY_PATTERN.match(sender_address(header(message, 'From'))):
+        return 'no_reply'
+    if SKIP_SEEN_THREADS and handled_threads:
+        handled_at = handled_threads.get(message.get('threadId'))
+        received_at = internal_date(message)
+        if handled_at is not None and received_at is not None and received_at > handled_at:
+            return 'seen_thread'
+    return None
+
+
+def _decode_data(data: str) -> str:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)).decode('utf-8', errors='replace')
+
+
+def _collect_text(part: dict, mime_type: str, texts: List[str], budget: int) -> int:
+    """Append the decoded mime_type leaves under part to texts depth first; returns the budget left."""
+    if budget <= 0:
+        return budget
+    # Attachments, inline or not, are never decoded
+    if part.get('filename') or part.get('body', {}).get('attachmentId'):
+        return budget
+    if part.get('parts'):
+        for child in part['parts']:
+            budget = _collect_text(child, mime_type, texts, budget)
+        return budget
+    if part.get('mimeType', '').lower() == mime_type:
+        data = part.get('body', {}).get('data')
+        if data:
+            # base64 holds 3 bytes per 4 characters; decode no more than the budget can use
+            # (at most 4 bytes per character), rounded to whole 4-character groups
+            text = _decode_data(data[:(budget * 16 // 3 + 3) // 4 * 4])[:budget]
+            texts.append(text)
+            budget -= len(text)
+    return budget
+
+
+def html_to_text(html: str) -> str:
+    return ' '.join(_TAG_PATTERN.sub(' ', _INVISIBLE_PATTERN.sub(' ', html)).split())
+
+
+def extract_text(payload: dict, limit: int = MAX_BODY_CHARS) -> str:
+    """
+    Plain text of a message payload, walking nested multiparts at any depth
+    and skipping attachment bodies. text/plain parts are used when there are
+    any, HTML parts stripped of their markup otherwise. At most limit
+    characters are decoded and returned.
+    """
+    texts = []
+    _collect_text(payload, 'text/plain', texts, limit)
+    if texts:
+        return ''.join(texts)
+    _collect_text(payload, 'text/html', texts, limit * 4)
+    return html_to_text(''.join(texts))[:limit]
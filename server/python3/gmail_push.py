@@ -0,0 +1,44 @@
+import base64
+import json
+import logging
+import os
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Pub/Sub topic Gmail publishes mailbox changes to (projects/<project>/topics/<topic>);
+# push ingestion is off unless it is set
+PUSH_TOPIC = os.getenv('GMAIL_PUSH_TOPIC') or None
+# Shared secret the push subscription sends as ?token=..., if set
+PUSH_TOKEN = os.getenv('GMAIL_PUSH_TOKEN') or None
+WATCH_LABELS = [label for label in os.getenv('GMAIL_PUSH_LABELS', 'INBOX').split(',') if label]
+
+
+def decode_notification(data: str) -> dict:
+    """
+    Decode the data of a Gmail Pub/Sub message: base64 JSON holding the
+    emailAddress and the historyId the mailbox reached. Raises ValueError
+    if it is not one.
+    """
+    try:
+        payload = json.loads(base64.b64decode(data))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Undecodable notification data: {e}")
+    if not isinstance(payload, dict) or 'historyId' not in payload:
+        raise ValueError("Notification carries no historyId")
+    return payload
+
+
+def encode_notification(email_address: str, history_id) -> str:
+    """Message data as Gmail publishes it; used by the local stand-in publisher."""
+    payload = {'emailAddress': email_address, 'historyId': int(history_id)}
+    return base64.b64encode(json.dumps(payload).encode()).decode()
+
+
+def watch(service, topic: str, labels=None, user_id='me') -> Optional[float]:
+    """(Re)start Gmail push notifications to topic; returns when the watch expires, in epoch seconds."""
+    body = {'topicName': topic, 'labelIds': labels or WATCH_LABELS, 'labelFilterBehavior': 'INCLUDE'}
+    response = service.users().watch(userId=user_id, body=body).execute()
+    expiration = response.get('expiration')
+    logger.info(f"Gmail watch on {topic} active until {expiration} (history {response.get('historyId')})")
+    return int(expiration) / 1000 if expiration else None
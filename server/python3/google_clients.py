@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import threading
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest'
+# Socket timeout in seconds for Google API calls
+HTTP_TIMEOUT = float(os.getenv('GOOGLE_HTTP_TIMEOUT', '30'))
+
+_documents = {}
+_documents_lock = threading.Lock()
+_local = threading.local()
+_stats = {'discovery_loads': 0, 'clients_built': 0, 'clients_reused': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _discovery_document(api, version):
+    """Parse the discovery document for an API once per process."""
+    key = (api, version)
+    with _documents_lock:
+        if key not in _documents:
+            content = discovery_cache.get_static_doc(api, version)
+            if content is None:
+                response, content = httplib2.Http(timeout=HTTP_TIMEOUT).request(
+                    DISCOVERY_URL.format(api=api, version=version)
+                )
+                if response.status != 200:
+                    raise RuntimeError(f"Could not fetch discovery document for {api} {version}: {response.status}")
+            _documents[key] = json.loads(content)
+            _count('discovery_loads')
+        return _documents[key]
+
+
+def _credentials_key(creds):
+    # Credentials are reloaded from token.json all over the place, so key on the
+    # refresh token rather than the object identity when we can.
+    return getattr(creds, 'refresh_token', None) or id(creds)
+
+
+def get_service(api, version, creds):
+    """
+    Return a Google API client for the calling thread.
+
+    Each thread keeps one client per API and credentials, backed by its own
+    keep-alive HTTP transport (httplib2 is not thread safe). Discovery
+    documents are shared by the whole process.
+    """
+    clients = getattr(_local, 'clients', None)
+    if clients is None:
+        clients = _local.clients = {}
+
+    key = (api, version, _credentials_key(creds))
+    service = clients.get(key)
+    if service is not None:
+        _count('clients_reused')
+        return service
+
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+    service = build_from_document(_discovery_document(api, version), http=http)
+    clients[key] = service
+    _count('clients_built')
+    return service
+
+
+def prewarm(creds):
+    """Load discovery documents and build the clients used by the agents."""
+    for api, version in [('gmail', 'v1'), ('calendar', 'v3')]:
+        get_service(api, version, creds)
+    logger.info(f"Prewarmed Google API clients: {client_stats()}")
+
+
+def client_stats():
+    """Counters for this process: discovery documents parsed, clients built and reused."""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,378 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from itertools import islice
+from typing import Callable, Iterable, Optional
+
+from googleapiclient.errors import HttpError
+
+import db
+from agents import (
+    analyze_decoded_email, decode_message, handled_threads, mark_skipped, persist_email, record_failure, retrying
+)
+from gmail_batch import BATCH_SIZE, fetch_messages
+from gmail_history import HistoryReader
+from gmail_message import METADATA_HEADERS, skip_reason
+from gmail_push import PUSH_TOPIC, watch
+from pipeline import Pipeline, Stage
+from processed_messages import get_processed_messages
+
+logger = logging.getLogger(__name__)
+
+# Bounds of the adaptive Gmail poll interval, in seconds
+MIN_POLL_INTERVAL = float(os.getenv('INGEST_MIN_POLL_INTERVAL', '5'))
+MAX_POLL_INTERVAL = float(os.getenv('INGEST_MAX_POLL_INTERVAL', '300'))
+# Growth of the interval after each poll that found no mail
+BACKOFF_FACTOR = 1.5
+# With push notifications on, polling only catches notifications that got lost
+SAFETY_POLL_INTERVAL = float(os.getenv('INGEST_SAFETY_POLL_INTERVAL', '900'))
+# How long to let a burst of notifications gather before the one poll that serves them all
+PUSH_COALESCE_S = float(os.getenv('INGEST_PUSH_COALESCE_MS', '500')) / 1000
+# Gmail watches expire after 7 days; Google recommends renewing daily
+WATCH_RENEW_INTERVAL = 24 * 3600
+
+# Workers per pipeline stage; analysis waits on the models, so it gets the most
+FETCH_WORKERS = int(os.getenv('PIPELINE_FETCH_WORKERS', '1'))
+DECODE_WORKERS = int(os.getenv('PIPELINE_DECODE_WORKERS', '1'))
+ANALYSIS_WORKERS = int(os.getenv('PIPELINE_ANALYSIS_WORKERS', '4'))
+PERSIST_WORKERS = int(os.getenv('PIPELINE_PERSIST_WORKERS', '1'))
+# Items each stage may hold queued before the stage feeding it blocks
+QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '16'))
+# Polls a failing message holds the checkpoint for before it is given up on
+MAX_ATTEMPTS = int(os.getenv('INGEST_MAX_ATTEMPTS', '3'))
+
+
+def load_history_id(account='me') -> Optional[int]:
+    """The Gmail history ID everything before which has been processed, if any."""
+    row = db.query_one('SELECT history_id FROM gmail_sync WHERE account = ?', (account,))
+    return row[0] if row else None
+
+
+def save_history_id(history_id, account='me'):
+    """Advance the checkpoint; it never moves backwards, whichever process writes last."""
+    with db.writer() as conn:
+        conn.execute('''
+            INSERT INTO gmail_sync (account, history_id) VALUES (?, ?)
+            ON CONFLICT(account) DO UPDATE SET
+                history_id = MAX(history_id, excluded.history_id),
+                updated_at = CURRENT_TIMESTAMP
+        ''', (account, int(history_id)))
+
+
+def reset_history_id(history_id, account='me'):
+    """Move the checkpoint to history_id even if that is backwards, e.g. after Gmail expired it."""
+    with db.writer() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO gmail_sync (account, history_id, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        ''', (account, int(history_id)))
+
+
+def chunks(items: Iterable, size: int):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def build_email_pipeline(service_factory: Callable, skipped: Optional[Counter] = None,
+                         max_attempts=MAX_ATTEMPTS) -> Pipeline:
+    """
+    fetch -> decode -> analysis -> persist. The fetch stage takes chunks of
+    message IDs and drops the processed ones, batch-fetches headers only
+    (format='metadata') to rule out bulk mail, no-reply senders and later
+    messages in threads already handled, and fetches just the remaining
+    candidates in full. Messages being retried are never ruled out for their
+    thread, whatever was handled in it while they waited. The
+    persist stage commits each email in its own transaction. A message that
+    failed in any stage max_attempts times is marked processed and counted
+    as skipped for 'failed' instead of failing again. Skips are counted by
+    reason in skipped.
+    """
+    skipped = Counter() if skipped is None else skipped
+
+    def exhausted(msg_id, error) -> bool:
+        """Record a failed attempt at msg_id; True if that was its last and it is now given up on."""
+        attempts = record_failure(msg_id, error)
+        if attempts < max_attempts:
+            return False
+        logger.error(f"Giving up on message {msg_id} after {attempts} failed attempts: {error}")
+        skipped['failed'] += 1
+        mark_skipped([{'id': msg_id}])
+        return True
+
+    def attempt(fn, msg_id_of):
+        """fn, except that an item failing for the last time is dropped rather than raising."""
+        def run(item):
+            try:
+                return fn(item)
+            except Exception as e:
+                if not exhausted(msg_id_of(item), e):
+                    raise
+                return []
+        return run
+
+    def fetch(msg_ids):
+        processed = get_processed_messages()
+        # Take in what other processes marked since the last batch before trusting the filter
+        processed.refresh()
+        msg_ids = processed.filter_unprocessed(msg_ids)
+        if not msg_ids:
+            return
+        service = service_factory()
+        metadata = fetch_messages(service, msg_ids, format='metadata', metadataHeaders=METADATA_HEADERS)
+        threads = handled_threads(message.get('threadId') for message in metadata.values())
+        retried = retrying(metadata)
+        ruled_out = []
+        for msg_id, message in metadata.items():
+            reason = skip_reason(message, None if msg_id in retried else threads)
+            if reason:
+                skipped[reason] += 1
+                ruled_out.append(message)
+        mark_skipped(ruled_out)
+        # IDs whose metadata fetch failed stay candidates; the full fetch decides
+        ruled_out = {message['id'] for message in ruled_out}
+        candidates = [msg_id for msg_id in msg_ids if msg_id not in ruled_out]
+
+        messages = fetch_messages(service, candidates) if candidates else {}
+        failed = []
+        for msg_id in candidates:
+            message = messages.get(msg_id)
+            if message is None:
+                # Its part of the batch failed; try once more on its own
+                try:
+                    message = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
+                except HttpError as error:
+                    if error.resp.status != 404:
+                        logger.error(f"Could not fetch message {msg_id}: {error}")
+                        if not exhausted(msg_id, error):
+                            failed.append(msg_id)
+                        continue
+                    # Deleted since it was added; there is nothing to process, now or later
+                    logger.info(f"Message {msg_id} no longer exists, skipping it")
+                    skipped['deleted'] += 1
+                    mark_skipped([{'id': msg_id}])
+                    continue
+                except Exception as e:
+                    logger.error(f"Could not fetch message {msg_id}: {e}")
+                    if not exhausted(msg_id, e):
+                        failed.append(msg_id)
+                    continue
+            yield msg_id, message
+
+        # Raised once the rest of the chunk has moved on, so the stage counts a
+        # failure and the poll keeps its checkpoint for a retry
+        if failed:
+            raise RuntimeError(f"Could not fetch {len(failed)} messages: {', '.join(failed)}")
+
+    return Pipeline([
+        Stage('fetch', fetch, FETCH_WORKERS, QUEUE_SIZE),
+        Stage('decode', attempt(lambda item: [decode_message(*item)], lambda item: item[0]),
+              DECODE_WORKERS, QUEUE_SIZE),
+        Stage('analysis', attempt(lambda email: [analyze_decoded_email(email)], lambda email: email['msg_id']),
+              ANALYSIS_WORKERS, QUEUE_SIZE),
+        Stage('persist', attempt(persist_email, lambda email: email['msg_id']), PERSIST_WORKERS, QUEUE_SIZE),
+    ])
+
+
+class IngestionScheduler:
+    """
+    Single owner of Gmail ingestion for this process.
+
+    Polls the history feed from a checkpoint stored in the gmail_sync table,
+    streams the new message IDs through the email pipeline, waits for it to
+    drain and only then advances the checkpoint, so a restart resumes where
+    the last committed batch ended. If any message failed on the way, the
+    checkpoint stays put and the next poll retries it; the ones that did
+    commit are filtered out as processed. A message that failed on
+    max_attempts polls is given up on, so one bad email cannot hold the
+    checkpoint forever.
+
+    Without a push topic the poll interval drops to min_interval as soon as
+    a poll finds mail and backs off towards max_interval while the inbox is
+    quiet. With one, Gmail push notifications (see notify()) trigger polls,
+    a burst of them coalesced into one poll, the watch is renewed daily and
+    a slow safety poll catches anything a lost notification would miss.
+    While the watch cannot be set up, polling stays adaptive.
+    """
+
+    def __init__(self, service_factory: Callable, account='me', min_interval=MIN_POLL_INTERVAL,
+                 max_interval=MAX_POLL_INTERVAL, push_topic=PUSH_TOPIC, max_attempts=MAX_ATTEMPTS):
+        self._service_factory = service_factory
+        self.account = account
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.push_topic = push_topic
+        self.interval = min_interval
+        self._checkpoint = None
+        self._watch_renewed_at = None
+        self._watch_expires_at = None
+        self._poll_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._skipped = Counter()
+        self.pipeline = build_email_pipeline(service_factory, self._skipped, max_attempts)
+        self._stats = {
+            'polls': 0, 'messages': 0, 'errors': 0, 'held': 0, 'resets': 0, 'last_poll_at': None,
+            'notifications': 0, 'stale_notifications': 0, 'watch_renewals': 0, 'watch_errors': 0
+        }
+
+    def start(self):
+        self.pipeline.start()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ingestion', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self.pipeline.stop()
+
+    def wake(self):
+        """Poll as soon as possible instead of waiting out the interval."""
+        self._wake.set()
+
+    def notify(self, history_id=None):
+        """
+        Handle a Gmail push notification. Notifications for history we already
+        processed are dropped; the rest only wake the loop, so any number of
+        them arriving together cost one history read.
+        """
+        self._stats['notifications'] += 1
+        if history_id is not None and self._checkpoint is not None and int(history_id) <= self._checkpoint:
+            self._stats['stale_notifications'] += 1
+            return
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.push_topic:
+                # A failed renewal must not stop polling; the next loop tries again
+                try:
+                    self._renew_watch()
+                except Exception as e:
+                    self._stats['watch_errors'] += 1
+                    logger.error(f"Could not renew the Gmail watch on {self.push_topic}: {e}")
+            try:
+                found = self.poll_once()
+            except Exception as e:
+                self._stats['errors'] += 1
+                logger.error(f"Error in ingestion poll: {e}")
+                found = 0
+            self._adapt(found)
+            if self._wake.wait(self.interval):
+                # Let the rest of a burst arrive; they are all served by the next poll
+                self._stop.wait(PUSH_COALESCE_S)
+            self._wake.clear()
+
+    def _renew_watch(self):
+        now = time.time()
+        if self._watch_renewed_at is not None and now - self._watch_renewed_at < WATCH_RENEW_INTERVAL:
+            return
+        self._watch_expires_at = watch(self._service_factory(), self.push_topic, user_id=self.account)
+        self._watch_renewed_at = now
+        self._stats['watch_renewals'] += 1
+
+    def _push_active(self) -> bool:
+        """Whether Gmail is currently publishing notifications for us."""
+        if not self.push_topic or self._watch_renewed_at is None:
+            return False
+        return self._watch_expires_at is None or self._watch_expires_at > time.time()
+
+    def _adapt(self, found):
+        # Until a watch is in place, poll as if push were off
+        if self._push_active():
+            self.interval = SAFETY_POLL_INTERVAL
+        elif found:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * BACKOFF_FACTOR)
+
+    def poll_once(self) -> int:
+        """Process mail added since the checkpoint and advance it; returns the number of new messages."""
+        with self._poll_lock:
+            service = self._service_factory()
+            start_history_id = load_history_id(self.account)
+            if start_history_id is None:
+                # First run: start from now, there is no earlier checkpoint to resume from
+                profile = service.users().getProfile(userId=self.account).execute()
+                save_history_id(profile['historyId'], self.account)
+                self._checkpoint = int(profile['historyId'])
+                logger.info(f"Initialized Gmail history checkpoint at {profile['historyId']}")
+                return 0
+            self._checkpoint = max(self._checkpoint or 0, start_history_id)
+
+            self.pipeline.start()
+            reader = HistoryReader(service, start_history_id, self.account)
+            persisted = self.pipeline.stages[-1].processed
+            errors = self.pipeline.errors
+            try:
+                # IDs stream from the history pages into the pipeline, which
+                # blocks the reader whenever a later stage falls behind
+                self.pipeline.feed(chunks(reader, BATCH_SIZE))
+            except HttpError as error:
+                if error.resp.status != 404:
+                    raise
+                # Gmail only keeps about a week of history; older checkpoints are rejected
+                profile = service.users().getProfile(userId=self.account).execute()
+                reset_history_id(profile['historyId'], self.account)
+                self._checkpoint = int(profile['historyId'])
+                self._stats['resets'] += 1
+                logger.warning(
+                    f"Gmail history checkpoint {start_history_id} expired, restarting from {profile['historyId']}"
+                )
+                return 0
+            finally:
+                self.pipeline.drain()
+            found = self.pipeline.stages[-1].processed - persisted
+            failed = self.pipeline.errors - errors
+
+            # Only after the batch is committed, so a crash replays rather than skips it
+            if failed:
+                self._stats['held'] += 1
+                logger.warning(
+                    f"Processing failed for {failed} pipeline items; keeping the checkpoint at {start_history_id} to retry them"
+                )
+            elif reader.history_id:
+                save_history_id(reader.history_id, self.account)
+                self._checkpoint = max(self._checkpoint or 0, int(reader.history_id))
+
+            self._stats['polls'] += 1
+            self._stats['messages'] += found
+            self._stats['last_poll_at'] = time.time()
+            return found
+
+    def stats(self):
+        return {
+            **self._stats,
+            'interval_s': self.interval,
+            'push': bool(self.push_topic),
+            'push_active': self._push_active(),
+            'watch_expires_at': self._watch_expires_at,
+            'skipped': dict(self._skipped),
+            'pipeline': self.pipeline.stats()
+        }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_ingestion(service_factory: Callable) -> IngestionScheduler:
+    """Create and start the process-wide ingestion scheduler."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = IngestionScheduler(service_factory)
+            _scheduler.start()
+        return _scheduler
+
+
+def get_ingestion_scheduler() -> Optional[IngestionScheduler]:
+    """The running scheduler, or None if ingestion was not started in this process."""
+    return _scheduler
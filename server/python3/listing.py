@@ -0,0 +1,97 @@
+import json
+from typing import Dict, List
+
+from fastapi import Response
+
+import db
+from pagination import NEXT_CURSOR_HEADER, encode_cursor, page
+
+ASSIGNEE_NAMES = ["Tabish Shaikh", "Riva Rodrigues", "Nirmitee Sarode"]
+
+# Field name -> SQL expression rendering it exactly as the Pydantic models
+# serialize it (timestamps in ISO 8601 with a 'T', assignee as a list)
+TASK_COLUMNS: Dict[str, str] = {
+    "title": "title",
+    "project": "project",
+    "assignee": "json_array(CASE abs(random()) % {count} {cases} END)".format(
+        count=len(ASSIGNEE_NAMES),
+        cases=' '.join(f"WHEN {i} THEN '{name}'" for i, name in enumerate(ASSIGNEE_NAMES))
+    ),
+    "dueDate": "due_date",
+    "status": "status",
+    "created_at": "strftime('%Y-%m-%dT%H:%M:%S', created_at)",
+}
+SENTIMENT_COLUMNS: Dict[str, str] = {
+    "msg_id": "msg_id",
+    "sentiment": "sentiment",
+    "confidence": "confidence",
+    "priority": "priority",
+    "processed_at": "strftime('%Y-%m-%dT%H:%M:%S', processed_at)",
+    "subject": "subject",
+    "snippet": "snippet",
+}
+TASK_FIELDS = list(TASK_COLUMNS)
+SENTIMENT_FIELDS = list(SENTIMENT_COLUMNS)
+# REAL fields. SQLite's JSON functions print them with 15 significant digits,
+# Python with as many as it takes to round-trip (0.991981148719788 vs
+# 0.9919811487197876), so SQLite leaves a placeholder that Python fills in.
+REAL_FIELDS = {"confidence"}
+_REAL_PLACEHOLDER = '\ue002'
+
+
+def json_object_sql(columns: Dict[str, str], fields: List[str]) -> str:
+    """SQL expression building one JSON object per row with the given fields, in order."""
+    return 'json_object({})'.format(', '.join(
+        f"'{field}', " + (f"'{_REAL_PLACEHOLDER}'" if field in REAL_FIELDS else columns[field])
+        for field in fields
+    ))
+
+
+def _real_columns_sql(columns: Dict[str, str], fields: List[str]) -> str:
+    """The raw REAL values selected after the sort keys, for _render to splice in."""
+    return ''.join(f", {columns[field]}" for field in fields if field in REAL_FIELDS)
+
+
+def _render(rows, limit, fields: List[str]):
+    """Join the per-row JSON documents of a limit + 1 fetch into one array, with the next page's key."""
+    rows, more = page(rows, limit)
+    reals = [field for field in fields if field in REAL_FIELDS]
+    documents = []
+    for row in rows:
+        document = row[0]
+        for field, value in zip(reals, row[3:]):
+            # Keys and string values come out JSON-escaped, so only the placeholder can match
+            document = document.replace(f'"{field}":"{_REAL_PLACEHOLDER}"', f'"{field}":{json.dumps(value)}', 1)
+        documents.append(document)
+    body = ('[' + ','.join(documents) + ']').encode('utf-8')
+    next_cursor = encode_cursor(rows[-1][1], rows[-1][2]) if more else None
+    return body, next_cursor
+
+
+def tasks_page(where: str, params: list, limit: int, fields: List[str]):
+    """Render a page of tasks as JSON bytes inside SQLite; returns (body, next_cursor)."""
+    rows = db.query(f'''
+        SELECT {json_object_sql(TASK_COLUMNS, fields)}, created_at, id{_real_columns_sql(TASK_COLUMNS, fields)}
+        FROM tasks
+        {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    ''', params + [limit + 1])
+    return _render(rows, limit, fields)
+
+
+def sentiment_page(where: str, params: list, limit: int, fields: List[str]):
+    """Render a page of sentiment results as JSON bytes inside SQLite; returns (body, next_cursor)."""
+    rows = db.query(f'''
+        SELECT {json_object_sql(SENTIMENT_COLUMNS, fields)}, processed_at, msg_id{_real_columns_sql(SENTIMENT_COLUMNS, fields)}
+        FROM sentiment_analysis
+        {where}
+        ORDER BY processed_at DESC, msg_id DESC
+        LIMIT ?
+    ''', params + [limit + 1])
+    return _render(rows, limit, fields)
+
+
+def json_list_response(body: bytes, next_cursor=None) -> Response:
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return Response(body, media_type='application/json', headers=headers)
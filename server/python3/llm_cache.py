@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on stored responses; least recently used ones are evicted beyond it
+MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '10000'))
+# Seconds a hit may leave last_used_at stale; eviction order only needs it roughly right
+TOUCH_INTERVAL = float(os.getenv('LLM_CACHE_TOUCH_INTERVAL', '300'))
+
+
+def normalize(text: str) -> str:
+    """Collapse whitespace so re-wrapped copies of the same text share a key."""
+    return ' '.join(text.split())
+
+
+class LLMCache:
+    """
+    Persistent cache of LLM responses in SQLite.
+
+    Keys are a hash of the model, the prompt template version and the
+    normalized input, so bumping a template version invalidates its entries.
+    Every entry carries an expiry chosen by the caller, and the table is kept
+    under max_entries by evicting the least recently used rows.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        # Lookups always miss when disabled, e.g. while benchmarking model latency
+        self.enabled = os.getenv('LLM_CACHE_ENABLED', '1') != '0'
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._inserts = 0
+        self._evictions = 0
+        self._count = self._load_count()
+
+    def _load_count(self):
+        return db.reader().execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+
+    @staticmethod
+    def key(model: str, prompt_version, text: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model, str(prompt_version), normalize(text)):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """Return the cached response for key, or None if missing or expired."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        try:
+            cursor = db.reader().cursor()
+            cursor.execute('SELECT response, expires_at, last_used_at FROM llm_cache WHERE key = ?', (key,))
+            row = cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Error reading LLM cache entry: {e}")
+            row = None
+        if row and row[1] > now:
+            # Hits only write once per TOUCH_INTERVAL, and never fail the lookup:
+            # the response is good whether or not the LRU touch lands
+            if now - row[2] > TOUCH_INTERVAL:
+                try:
+                    with db.writer() as conn:
+                        conn.execute('UPDATE llm_cache SET last_used_at = ? WHERE key = ?', (now, key))
+                except Exception as e:
+                    logger.warning(f"Error touching LLM cache entry: {e}")
+            with self._lock:
+                self._hits += 1
+            return row[0]
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key: str, model: str, response: str, ttl: float):
+        """Store a response that stays valid for ttl seconds."""
+        now = time.time()
+        try:
+            with db.writer() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, last_used_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (key, model, response, now, now, now + ttl))
+
+                # The running count is approximate (other processes write too);
+                # an eviction pass recounts the table.
+                with self._lock:
+                    self._inserts += 1
+                    self._count += 1
+                    evict = self._count > self.max_entries
+                if evict:
+                    self._evict(cursor, now)
+        except Exception as e:
+            logger.error(f"Error writing LLM cache entry: {e}")
+
+    def _evict(self, cursor, now):
+        cursor.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (now,))
+        evicted = cursor.rowcount
+        cursor.execute('SELECT COUNT(*) FROM llm_cache')
+        count = cursor.fetchone()[0]
+        # Evict down to 90% of the bound so full caches do not recount on every insert
+        excess = count - int(self.max_entries * 0.9) if count > self.max_entries else 0
+        if excess > 0:
+            cursor.execute('''
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY last_used_at LIMIT ?
+                )
+            ''', (excess,))
+            evicted += cursor.rowcount
+        with self._lock:
+            self._evictions += evicted
+            self._count = count - max(excess, 0)
+
+    def stats(self):
+        """Hit/miss counters for this process."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'inserts': self._inserts,
+                'evictions': self._evictions,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """Return the process-wide LLM response cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
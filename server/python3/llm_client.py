@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+# Point OPENAI_BASE_URL at a local mock server to run without OpenAI
+BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+MAX_IN_FLIGHT = int(os.getenv('OPENAI_MAX_IN_FLIGHT', '8'))
+REQUESTS_PER_MINUTE = float(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '500'))
+TOKENS_PER_MINUTE = float(os.getenv('OPENAI_TOKENS_PER_MINUTE', '200000'))
+MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '5'))
+# Seconds a single call may take in total, retries and rate-limit waits included
+CALL_DEADLINE = float(os.getenv('OPENAI_CALL_DEADLINE', '60'))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+
+
+def estimate_tokens(messages, max_tokens):
+    """Rough prompt + completion token count used for rate limiting (~4 characters per token)."""
+    prompt_chars = sum(len(message.get('content', '')) for message in messages)
+    return prompt_chars // 4 + max_tokens
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate_per_minute, holding at most one minute's worth."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """Wait until amount tokens are available and take them; returns the seconds waited."""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return waited
+            delay = (amount - self.tokens) / self.rate
+            waited += delay
+            await asyncio.sleep(delay)
+
+    def adjust(self, amount):
+        """Charge (or refund, if negative) the difference between estimated and actual usage."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+def _is_retryable(error):
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+def _retry_after(error):
+    """Seconds the server asked us to wait, if it said so."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    """
+    Async OpenAI chat client with an in-flight limit, request and token rate
+    limits, jittered exponential backoff on 429/5xx and per-call deadlines.
+
+    All calls run on one event loop owned by a background thread, so the
+    limits hold across every caller in the process. Coroutines can await
+    complete() from any loop; blocking code can use run().
+    """
+
+    def __init__(self, base_url=BASE_URL, max_in_flight=MAX_IN_FLIGHT,
+                 requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='llm-client', daemon=True)
+        self._thread.start()
+        # Retries are ours, not the SDK's
+        self._client = AsyncOpenAI(base_url=base_url, max_retries=0)
+        self._max_in_flight = max_in_flight
+        self._semaphore = None
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._stats = {
+            'calls': 0, 'in_flight': 0, 'retries': 0, 'failures': 0,
+            'deadline_exceeded': 0, 'rate_limited_s': 0.0
+        }
+
+    def run(self, coro):
+        """Run a coroutine on the client loop and block until it finishes."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def complete(self, *, model, messages, max_tokens, deadline=CALL_DEADLINE, **kwargs):
+        """Return the stripped message content of a chat completion."""
+        coro = asyncio.wait_for(self._complete(model, messages, max_tokens, **kwargs), deadline)
+        try:
+            if asyncio.get_running_loop() is self._loop:
+                return await coro
+            return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+        except asyncio.TimeoutError:
+            self._stats['deadline_exceeded'] += 1
+            raise
+
+    async def _complete(self, model, messages, max_tokens, **kwargs):
+        if self._semaphore is None:
+            # Created on the client loop so it is bound to it
+            self._semaphore = asyncio.Semaphore(self._max_in_flight)
+        self._stats['calls'] += 1
+        estimate = estimate_tokens(messages, max_tokens)
+        for attempt in range(MAX_RETRIES + 1):
+            self._stats['rate_limited_s'] += await self._requests.acquire(1)
+            self._stats['rate_limited_s'] += await self._tokens.acquire(estimate)
+            try:
+                async with self._semaphore:
+                    self._stats['in_flight'] += 1
+                    try:
+                        response = await self._client.chat.completions.create(
+                            model=model, messages=messages, max_tokens=max_tokens, **kwargs
+                        )
+                    finally:
+                        self._stats['in_flight'] -= 1
+            except Exception as e:
+                if not _is_retryable(e) or attempt == MAX_RETRIES:
+                    self._stats['failures'] += 1
+                    raise
+                delay = _retry_after(e) or random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                self._stats['retries'] += 1
+                logger.warning(f"OpenAI call failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.usage is not None:
+                self._tokens.adjust(response.usage.total_tokens - estimate)
+            return response.choices[0].message.content.strip()
+
+    def stats(self):
+        return dict(self._stats)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """Return the process-wide LLM client."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient()
+        return _client
+
+
+def llm_client_stats():
+    """Stats of the process-wide client, or None if nothing has used it yet (e.g. no API key configured)."""
+    client = _client
+    return client.stats() if client is not None else None
@@ -0,0 +1,99 @@
+import argparse
+import itertools
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_SCHEDULE_TEXT = "Schedule a project sync tomorrow at 15:00 with ravi@example.com"
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"requests": 0}
+    return {
+        "requests": len(latencies),
+        "mean_s": statistics.mean(latencies),
+        "p50_s": latencies[len(latencies) // 2],
+        "p95_s": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+_request_ids = itertools.count()
+
+
+def read_tasks(url, stop, latencies):
+    """Call GET /tasks back to back until stop is set, recording each latency."""
+    session = requests.Session()
+    while not stop.is_set():
+        # A since that matches every row but differs per request, so the response
+        # cache never answers and each read reaches the database
+        since = f"1970-01-01T00:00:00.{next(_request_ids) % 1000000:06d}"
+        started = time.perf_counter()
+        session.get(f"{url}/tasks", params={"limit": 100, "since": since}).raise_for_status()
+        latencies.append(time.perf_counter() - started)
+
+
+def schedule(url, text, stop, latencies):
+    """Call POST /schedule back to back until stop is set, recording each latency."""
+    session = requests.Session()
+    while not stop.is_set():
+        started = time.perf_counter()
+        session.post(f"{url}/schedule", json={"text": text})
+        latencies.append(time.perf_counter() - started)
+
+
+def run_phase(url, readers, schedulers, duration, text):
+    stop = threading.Event()
+    read_latencies, schedule_latencies = [], []
+    with ThreadPoolExecutor(max_workers=readers + schedulers) as pool:
+        futures = [pool.submit(read_tasks, url, stop, read_latencies) for _ in range(readers)]
+        futures += [pool.submit(schedule, url, text, stop, schedule_latencies) for _ in range(schedulers)]
+        time.sleep(duration)
+        stop.set()
+        for future in futures:
+            future.result()
+    return summarize(read_latencies), summarize(schedule_latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that concurrent /tasks reads keep their latency while /schedule calls are in flight. "
+                    "/schedule calls the LLM and can create calendar events and send invitations, so run the "
+                    "server against mock_llm.py (OPENAI_BASE_URL=http://localhost:8100/v1) and without "
+                    "token.json; the mock never asks for a meeting."
+    )
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--schedulers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per phase")
+    parser.add_argument("--text", default=DEFAULT_SCHEDULE_TEXT, help="request text sent to /schedule")
+    parser.add_argument("--max-slowdown", type=float, default=2.0,
+                        help="fail if /tasks p95 under /schedule load exceeds baseline p95 by this factor")
+    parser.add_argument("--mock-llm", action="store_true",
+                        help="confirm the server runs against mock_llm.py without Google credentials")
+    args = parser.parse_args()
+    if not args.mock_llm:
+        parser.error("refusing to send /schedule load to a server that may call OpenAI and Google; "
+                     "start it against mock_llm.py without token.json and pass --mock-llm")
+
+    baseline, _ = run_phase(args.url, args.readers, 0, args.duration, args.text)
+    loaded, scheduled = run_phase(args.url, args.readers, args.schedulers, args.duration, args.text)
+    slowdown = loaded["p95_s"] / baseline["p95_s"] if baseline.get("p95_s") and loaded.get("p95_s") else None
+
+    print(json.dumps({
+        "tasks_baseline": baseline,
+        "tasks_with_schedule": loaded,
+        "schedule": scheduled,
+        "p95_slowdown": slowdown,
+    }, indent=2))
+    if slowdown is None or slowdown > args.max_slowdown:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,50 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import ray
-from googleapiclient.discovery import build
 from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request  
+from google.auth.transport.requests import Request as GoogleAuthRequest
 from agents import (
     schedule_meeting,
     reschedule_meeting,
-    learn_from_feedback,
-    email_handler,
-    initialize_history_id,
-    fetch_new_emails
+    learn_from_feedback
 )
-import sqlite3
+import db
+from export import NDJSON_MEDIA_TYPE, iter_ndjson
+from google_clients import get_service, prewarm, client_stats
+from gmail_push import PUSH_TOKEN, decode_notification
+from ingestion import get_ingestion_scheduler, start_ingestion
+from llm_cache import get_llm_cache
+from llm_client import llm_client_stats
+from migrations import migrate
+from processed_messages import get_processed_messages
+from listing import (
+    SENTIMENT_FIELDS,
+    TASK_FIELDS,
+    json_list_response,
+    sentiment_page,
+    tasks_page
+)
+from response_cache import get_response_cache
+from search import search_emails, search_tasks
+from pagination import (
+    DEFAULT_LIMIT,
+    MAX_LIMIT,
+    NEXT_CURSOR_HEADER,
+    db_timestamp,
+    decode_cursor,
+    encode_cursor,
+    page,
+    parse_fields
+)
+from sentiment_model import sentiment_model_ready, sentiment_model_stats
 import asyncio
-import threading
-import time
 import logging
 import os
-from typing import List
-from datetime import datetime
+from typing import List, Literal, Optional
+from datetime import date, datetime
 from fastapi.middleware.cors import CORSMiddleware
-import random 
 
 
 # Set up logging
@@ -46,7 +69,8 @@ app.add_middleware(
     allow_origins=["*"],  # Allows all origins
     allow_credentials=True,
     allow_methods=["*"],  # Allows all HTTP methods
-    allow_headers=["*"]  # Allows all headers
+    allow_headers=["*"],  # Allows all headers
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"]
 )
 
 # Define request models
@@ -64,14 +88,25 @@ class FeedbackRequest(BaseModel):
     rating: int
     comments: str
 
+class PubSubMessage(BaseModel):
+    data: str
+    messageId: Optional[str] = None
+    publishTime: Optional[str] = None
+    attributes: Optional[dict] = None
+
+class PushNotification(BaseModel):
+    message: PubSubMessage
+    subscription: Optional[str] = None
+
 class SentimentAnalysis(BaseModel):
     msg_id: str
-    sentiment: str
-    confidence: float
-    priority: str
+    sentiment: Optional[str] = None
+    confidence: Optional[float] = None
+    priority: Optional[str] = None
     processed_at: datetime
-    subject: str
-    body: str
+    subject: Optional[str] = None
+    snippet: Optional[str] = None
+    body: Optional[str] = None
 
 class Task(BaseModel):
     title: str
@@ -90,68 +125,181 @@ class TaskAnalysis(BaseModel):
 
 # API Endpoints
 @app.get("/tasks", response_model=List[Task])
-async def get_tasks():
-    """Get all tasks extracted from emails."""
-    try:
-        conn = sqlite3.connect('scheduler.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT msg_id, title, project, assignee, due_date, status, created_at 
-            FROM tasks 
-            ORDER BY created_at DESC
-        ''')
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        names = ["Tabish Shaikh", "Riva Rodrigues", "Nirmitee Sarode"]
-        
-        return [
-            Task(
-                title=row[1],
-                project=row[2],
-                assignee=[random.choice(names)],
-                dueDate=row[4],
-                status=row[5],
-                created_at=datetime.fromisoformat(row[6])
-            )
-            for row in results
-        ]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def get_tasks(
+    request: Request,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    status: Optional[str] = None,
+    project: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """
+    Get tasks extracted from emails, newest first, one page at a time.
+    Pass the X-Next-Cursor response header back as cursor for the next page.
+    """
+    after = decode_cursor(cursor, 2)
+    selected = parse_fields(fields, TASK_FIELDS)
+
+    async def render():
+        try:
+            conditions, params = [], []
+            if after:
+                # Keyset condition on (created_at, id), written so the created_at index is used
+                conditions.append("created_at <= ? AND (created_at < ? OR id < ?)")
+                params += [after[0], after[0], after[1]]
+            if since:
+                conditions.append("created_at >= ?")
+                params.append(db_timestamp(since))
+            if until:
+                conditions.append("created_at < ?")
+                params.append(db_timestamp(until))
+            if status:
+                conditions.append("status = ?")
+                params.append(status)
+            if project:
+                conditions.append("project = ?")
+                params.append(project)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+            # The JSON is built by SQLite, bypassing per-row models and encoding
+            body, next_cursor = await db.run(tasks_page, where, params, limit, selected)
+            return json_list_response(body, next_cursor)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/sentiment/emails", response_model= List[SentimentAnalysis])
-async def get_email_sentiments():
-    """Get sentiment analysis results for all processed emails."""
-    try:
-        conn = sqlite3.connect('scheduler.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT msg_id, sentiment, confidence, priority, processed_at ,subject,body
-            FROM sentiment_analysis 
-            ORDER BY processed_at DESC
-        ''')
-        
-        results = cursor.fetchall()
-        conn.close()
-        
-        return [
-            SentimentAnalysis(
-                msg_id=row[0],
-                sentiment=row[1],
-                confidence=row[2],
-                priority=row[3],
-                processed_at=datetime.fromisoformat(row[4]),
-                subject=row[5],
-                body=row[6]
+    return await get_response_cache().serve(request, ["tasks"], render)
 
+@app.get("/sentiment/emails", response_model= List[SentimentAnalysis])
+async def get_email_sentiments(
+    request: Request,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    priority: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """
+    Get sentiment analysis results for processed emails, newest first, one page at a time.
+    Lists carry a snippet of each body; fetch /sentiment/emails/{msg_id} for the full body.
+    """
+    after = decode_cursor(cursor, 2)
+    selected = parse_fields(fields, SENTIMENT_FIELDS)
+
+    async def render():
+        try:
+            conditions, params = [], []
+            if after:
+                conditions.append("processed_at <= ? AND (processed_at < ? OR msg_id < ?)")
+                params += [after[0], after[0], after[1]]
+            if since:
+                conditions.append("processed_at >= ?")
+                params.append(db_timestamp(since))
+            if until:
+                conditions.append("processed_at < ?")
+                params.append(db_timestamp(until))
+            if priority:
+                conditions.append("priority = ?")
+                params.append(priority)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+            body, next_cursor = await db.run(sentiment_page, where, params, limit, selected)
+            return json_list_response(body, next_cursor)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return await get_response_cache().serve(request, ["sentiment_analysis"], render)
+
+
+@app.get("/tasks/export")
+def export_tasks(since: Optional[datetime] = None):
+    """
+    Stream every task as newline-delimited JSON, oldest first.
+    Pass since to pull only tasks created at or after it.
+    """
+    where, params = ("WHERE created_at >= ?", (db_timestamp(since),)) if since else ("", ())
+    return StreamingResponse(
+        iter_ndjson(f'''
+            SELECT id, msg_id, title, project, assignee, due_date, status, created_at
+            FROM tasks
+            {where}
+            ORDER BY created_at, id
+        ''', params),
+        media_type=NDJSON_MEDIA_TYPE
+    )
+
+@app.get("/sentiment/emails/export")
+def export_email_sentiments(since: Optional[datetime] = None):
+    """
+    Stream every sentiment analysis result as newline-delimited JSON, oldest first.
+    Pass since to pull only emails processed at or after it.
+    """
+    where, params = ("WHERE processed_at >= ?", (db_timestamp(since),)) if since else ("", ())
+    return StreamingResponse(
+        iter_ndjson(f'''
+            SELECT msg_id, subject, decompress_body(body_z) AS body, sentiment, confidence, priority, processed_at
+            FROM sentiment_analysis
+            {where}
+            ORDER BY processed_at, msg_id
+        ''', params),
+        media_type=NDJSON_MEDIA_TYPE
+    )
+
+@app.get("/sentiment/emails/{msg_id}", response_model=SentimentAnalysis)
+async def get_email_sentiment(request: Request, msg_id: str):
+    """Get one email's sentiment analysis result with its full, decompressed body."""
+    async def render():
+        row = await db.run(db.query_one, '''
+            SELECT msg_id, sentiment, confidence, priority, processed_at, subject, snippet,
+                   decompress_body(body_z) AS body
+            FROM sentiment_analysis
+            WHERE msg_id = ?
+        ''', (msg_id,))
+        if row is None:
+            raise HTTPException(status_code=404, detail="Email not found.")
+        values = dict(zip(SENTIMENT_FIELDS + ["body"], row))
+        values["processed_at"] = datetime.fromisoformat(values["processed_at"])
+        return JSONResponse(jsonable_encoder(SentimentAnalysis(**values)))
+
+    return await get_response_cache().serve(request, ["sentiment_analysis"], render)
+
+@app.get("/search")
+async def search(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    type: Literal["emails", "tasks"] = "emails",
+    limit: int = Query(20, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    priority: Optional[str] = None,
+    sentiment: Optional[str] = None,
+    status: Optional[str] = None,
+    project: Optional[str] = None
+):
+    """
+    Full-text search over emails (subject, body) or tasks (title, project, assignee),
+    best matches first with matches wrapped in <mark>. q uses FTS5 query syntax.
+    """
+    after = decode_cursor(cursor, 2)
+
+    async def render():
+        if type == "emails":
+            results, next_cursor = await db.run(
+                search_emails, q, limit, after, priority=priority, sentiment=sentiment,
+                since=db_timestamp(since), until=db_timestamp(until)
             )
-            for row in results
-        ]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        else:
+            results, next_cursor = await db.run(
+                search_tasks, q, limit, after, status=status, project=project,
+                since=db_timestamp(since), until=db_timestamp(until)
+            )
+        return JSONResponse({"results": results, "next_cursor": next_cursor})
+
+    tables = ["sentiment_analysis"] if type == "emails" else ["tasks"]
+    return await get_response_cache().serve(request, tables, render)
 
 
 @app.post("/schedule")
@@ -173,15 +321,11 @@ async def reschedule(request: RescheduleRequest):
 @app.post("/cancel")
 async def cancel(request: CancelRequest):
     try:
-        conn = sqlite3.connect('scheduler.db')
-        cursor = conn.cursor()
-        cursor.execute('''
+        await db.run(db.execute, '''
             UPDATE meetings
             SET status = 'canceled'
             WHERE id = ?
         ''', (request.meeting_id,))
-        conn.commit()
-        conn.close()
         return {"message": f"Meeting {request.meeting_id} canceled successfully."}
     except Exception as e:
         logger.error(f"Error canceling meeting: {e}")
@@ -195,70 +339,144 @@ async def feedback(request: FeedbackRequest):
 @app.post("/process_emails")
 async def process_emails():
     """Endpoint to trigger email processing manually."""
-    result = await email_handler.remote()
-    return {"message": result}
+    scheduler = get_ingestion_scheduler()
+    if scheduler is None:
+        raise HTTPException(status_code=503, detail="Email ingestion is not running.")
+    # Runs under the scheduler's poll lock, so it never overlaps a scheduled poll
+    found = await asyncio.to_thread(scheduler.poll_once)
+    return {"message": f"Processed {found} new emails."}
+
+@app.post("/gmail/push", status_code=204)
+async def gmail_push(notification: PushNotification, token: Optional[str] = None):
+    """
+    Receive Gmail watch notifications from a Pub/Sub push subscription.
+    Any 2xx acknowledges the message; errors make Pub/Sub redeliver it.
+    """
+    if PUSH_TOKEN and token != PUSH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid push token.")
+    try:
+        payload = decode_notification(notification.message.data)
+    except ValueError as e:
+        # Redelivering a malformed message would not help, so acknowledge it
+        logger.warning(f"Ignoring Gmail push notification: {e}")
+        return Response(status_code=204)
+    scheduler = get_ingestion_scheduler()
+    if scheduler is None:
+        raise HTTPException(status_code=503, detail="Email ingestion is not running.")
+    scheduler.notify(payload['historyId'])
+    return Response(status_code=204)
 
 @app.get("/meetings")
-def get_meetings():
-    """Fetch all meetings."""
-    try:
-        conn = sqlite3.connect('scheduler.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM meetings')
-        meetings = cursor.fetchall()
-        conn.close()
-        return {"meetings": meetings}
-    except Exception as e:
-        logger.error(f"Error fetching meetings: {e}")
-        raise HTTPException(status_code=500, detail="Error fetching meetings.")
+async def get_meetings(
+    request: Request,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None
+):
+    """Fetch meetings one page at a time; pass next_cursor back as cursor."""
+    after = decode_cursor(cursor, 1)
+
+    async def render():
+        try:
+            conditions, params = [], []
+            if after:
+                conditions.append("id > ?")
+                params.append(after[0])
+            if status:
+                conditions.append("status = ?")
+                params.append(status)
+            if since:
+                conditions.append("date >= ?")
+                params.append(since.isoformat())
+            if until:
+                conditions.append("date < ?")
+                params.append(until.isoformat())
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+            meetings = await db.run(
+                db.query, f'SELECT * FROM meetings {where} ORDER BY id LIMIT ?', params + [limit + 1]
+            )
+            meetings, more = page(meetings, limit)
+            next_cursor = encode_cursor(meetings[-1][0]) if more else None
+            return JSONResponse(jsonable_encoder({"meetings": meetings, "next_cursor": next_cursor}))
+        except Exception as e:
+            logger.error(f"Error fetching meetings: {e}")
+            raise HTTPException(status_code=500, detail="Error fetching meetings.")
+
+    return await get_response_cache().serve(request, ["meetings"], render)
 
 @app.get("/feedback")
-def get_feedback():
-    """Fetch all feedback."""
-    try:
-        conn = sqlite3.connect('scheduler.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM feedback')
-        feedback = cursor.fetchall()
-        conn.close()
-        return {"feedback": feedback}
-    except Exception as e:
-        logger.error(f"Error fetching feedback: {e}")
-        raise HTTPException(status_code=500, detail="Error fetching feedback.")
+async def get_feedback(
+    request: Request,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    cursor: Optional[str] = None,
+    meeting_id: Optional[int] = None
+):
+    """Fetch feedback one page at a time; pass next_cursor back as cursor."""
+    after = decode_cursor(cursor, 1)
+
+    async def render():
+        try:
+            conditions, params = [], []
+            if after:
+                conditions.append("id > ?")
+                params.append(after[0])
+            if meeting_id is not None:
+                conditions.append("meeting_id = ?")
+                params.append(meeting_id)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+            feedback = await db.run(
+                db.query, f'SELECT * FROM feedback {where} ORDER BY id LIMIT ?', params + [limit + 1]
+            )
+            feedback, more = page(feedback, limit)
+            next_cursor = encode_cursor(feedback[-1][0]) if more else None
+            return JSONResponse(jsonable_encoder({"feedback": feedback, "next_cursor": next_cursor}))
+        except Exception as e:
+            logger.error(f"Error fetching feedback: {e}")
+            raise HTTPException(status_code=500, detail="Error fetching feedback.")
+
+    return await get_response_cache().serve(request, ["feedback"], render)
 
 @app.get("/meeting/{meeting_id}")
-def get_meeting_details(meeting_id: int):
+async def get_meeting_details(meeting_id: int):
     """Fetch details of a specific meeting."""
     try:
-        conn = sqlite3.connect('scheduler.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM meetings WHERE id = ?', (meeting_id,))
-        meeting = cursor.fetchone()
-        cursor.execute('SELECT * FROM feedback WHERE meeting_id = ?', (meeting_id,))
-        feedback = cursor.fetchall()
-        conn.close()
+        meeting = await db.run(db.query_one, 'SELECT * FROM meetings WHERE id = ?', (meeting_id,))
+        feedback = await db.run(db.query, 'SELECT * FROM feedback WHERE meeting_id = ?', (meeting_id,))
         return {"meeting": meeting, "feedback": feedback}
     except Exception as e:
         logger.error(f"Error fetching meeting details: {e}")
         raise HTTPException(status_code=500, detail="Error fetching meeting details.")
 
-# Background Email Processing
-def email_processing_loop():
-    """Loop to process emails every 5 minutes."""
-    while True:
-        try:
-            result = ray.get(email_handler.remote())
-            logger.info(result)
-        except Exception as e:
-            logger.error(f"Error in background email processing: {e}")
-        time.sleep(300)  # Wait for 5 minutes
-
-
+@app.get("/stats")
+def get_stats():
+    """Runtime counters for this API process."""
+    scheduler = get_ingestion_scheduler()
+    return {
+        "google_clients": client_stats(),
+        "sentiment_batches": sentiment_model_stats(),
+        "llm_cache": get_llm_cache().stats(),
+        "llm_client": llm_client_stats(),
+        "response_cache": get_response_cache().stats(),
+        "processed_messages": get_processed_messages().stats(),
+        "ingestion": scheduler.stats() if scheduler else None
+    }
+
+@app.get("/ready")
+def ready():
+    """Readiness of components that load lazily after startup."""
+    return {"sentiment_model": sentiment_model_ready()}
 
 @app.on_event("startup")
 def startup_event():
-    """Start background thread for email listener."""
-    global LATEST_HISTORY_ID
+    """Migrate the database and start Gmail ingestion."""
+    # Bring the schema up to date before anything touches the database
+    migrate()
+    # Load processed message IDs once so duplicate notifications are rejected in memory
+    get_processed_messages()
     try:
         creds = None
         if os.path.exists('token.json'):
@@ -268,7 +486,7 @@ def startup_event():
         if not creds or not creds.valid:
             if creds and creds.expired and creds.refresh_token:
                 try:
-                    creds.refresh(Request())
+                    creds.refresh(GoogleAuthRequest())
                     # Save refreshed credentials
                     with open('token.json', 'w') as token:
                         token.write(creds.to_json())
@@ -279,29 +497,12 @@ def startup_event():
                 # Need to run authorize.py again
                 raise ValueError("Gmail credentials expired. Please run authorize.py to refresh.")
 
-        # Initialize Gmail service
-        gmail_service = build('gmail', 'v1', credentials=creds)
-
-        # Initialize History ID
-        initialize_history_id(gmail_service)
-
-        # Background email listener
-        def email_listener():
-            while True:
-                try:
-                    fetch_new_emails(gmail_service)
-                except Exception as e:
-                    logger.error(f"Error in email_listener: {e}")
-                time.sleep(10)  # Poll every 10 seconds
-
-        listener_thread = threading.Thread(target=email_listener, daemon=True)
-        listener_thread.start()
-
-        # Start the periodic email processing loop
-        processing_thread = threading.Thread(target=email_processing_loop, daemon=True)
-        processing_thread.start()
+        # Build the shared Google API clients before the first request needs them
+        prewarm(creds)
 
-        logger.info("Started email listener and processing threads.")
+        # One scheduler owns the Gmail history checkpoint and the polling
+        start_ingestion(lambda: get_service('gmail', 'v1', creds))
+        logger.info("Started email ingestion.")
     except Exception as e:
-        logger.error(f"Error starting email listener thread: {e}")
+        logger.error(f"Error starting email ingestion: {e}")
         # Don't raise here, just log the error to prevent app startup failure
\ No newline at end of file
@@ -0,0 +1,104 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Queue single inference requests and run them through the model in batches.
+
+    A batch is flushed as soon as it holds max_batch_size items or the oldest
+    item has waited max_wait_ms. infer_fn receives a list of inputs and must
+    return one result per input, in order; each caller gets its own result
+    through the Future returned by submit().
+    """
+
+    def __init__(self, infer_fn: Callable[[List], List], max_batch_size=16, max_wait_ms=20, name='batcher'):
+        self.infer_fn = infer_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._largest_batch = 0
+        self._latencies = deque(maxlen=256)
+
+    def submit(self, item) -> Future:
+        """Queue one input and return a Future for its result."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _ensure_worker(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        """Block for the first item, then gather more until the batch is full or the wait expires."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            started = time.monotonic()
+            try:
+                results = self.infer_fn(items)
+                if len(results) != len(items):
+                    raise ValueError(f"{self.name} returned {len(results)} results for {len(items)} inputs")
+            except Exception as e:
+                logger.error(f"Error running {self.name} batch of {len(items)}: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            latency = time.monotonic() - started
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._largest_batch = max(self._largest_batch, len(batch))
+                self._latencies.append((len(batch), latency))
+
+    def stats(self):
+        """Batch size and latency counters, with latencies over the recent batches."""
+        with self._stats_lock:
+            recent = sorted(latency for _, latency in self._latencies)
+            return {
+                'batches': self._batches,
+                'items': self._items,
+                'mean_batch_size': self._items / self._batches if self._batches else 0.0,
+                'largest_batch': self._largest_batch,
+                'recent_batch_sizes': [size for size, _ in self._latencies][-20:],
+                'mean_latency_ms': 1000 * sum(recent) / len(recent) if recent else 0.0,
+                'p95_latency_ms': 1000 * recent[int(0.95 * (len(recent) - 1))] if recent else 0.0,
+                'queue_depth': self._queue.qsize(),
+            }
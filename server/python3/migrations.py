@@ -0,0 +1,365 @@
+import argparse
+import logging
+
+import db
+from body_store import compress_body, make_snippet
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_compressed_bodies(conn, batch_size=500):
+    """Move plain text bodies into body_z and snippet, batch by batch, clearing body."""
+    last_row_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT rowid, body FROM sentiment_analysis WHERE rowid > ? AND body IS NOT NULL ORDER BY rowid LIMIT ?',
+            (last_row_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            'UPDATE sentiment_analysis SET body_z = ?, snippet = ?, body = NULL WHERE rowid = ?',
+            [(compress_body(body), make_snippet(body), row_id) for row_id, body in rows]
+        )
+        last_row_id = rows[-1][0]
+    if last_row_id:
+        logger.info("Compressed existing email bodies; run migrations.py --vacuum to return the freed pages to the OS")
+
+
+# Tables whose changes are counted in table_versions, for HTTP response caching.
+# Migration 4 installs their triggers; count further tables in a new migration.
+VERSIONED_TABLES = ('tasks', 'sentiment_analysis', 'meetings', 'feedback')
+
+# Forward-only schema migrations: (version, name, steps). A step is an SQL
+# statement or a function of the connection, for data migrations. Never edit
+# an applied migration; add a new one instead.
+MIGRATIONS = [
+    (1, "base schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            preferences TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS meetings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            attendees TEXT NOT NULL,
+            status TEXT NOT NULL CHECK(status IN ('scheduled', 'rescheduled', 'canceled','pending'))
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS feedback (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            meeting_id INTEGER,
+            rating INTEGER CHECK(rating >=1 AND rating <=5),
+            comments TEXT,
+            FOREIGN KEY(meeting_id) REFERENCES meetings(id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS processed_emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            msg_id TEXT UNIQUE NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            msg_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            project TEXT NOT NULL,
+            assignee TEXT NOT NULL,
+            due_date TEXT NOT NULL,
+            status TEXT DEFAULT 'Not started',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(msg_id, title)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sentiment_analysis (
+            msg_id TEXT PRIMARY KEY,
+            subject TEXT,
+            body TEXT,
+            sentiment TEXT,
+            confidence REAL,
+            priority TEXT,
+            processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, "calendar index and LLM cache", [
+        '''
+        CREATE TABLE IF NOT EXISTS calendar_events (
+            event_id TEXT NOT NULL,
+            calendar_id TEXT NOT NULL,
+            summary TEXT,
+            start_ts REAL NOT NULL,
+            end_ts REAL NOT NULL,
+            attendees TEXT,
+            PRIMARY KEY (calendar_id, event_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS calendar_sync (
+            calendar_id TEXT PRIMARY KEY,
+            sync_token TEXT,
+            version INTEGER NOT NULL DEFAULT 0,
+            synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used_at)',
+    ]),
+    (3, "indexes for lookups and listings", [
+        # reschedule_meeting looks meetings up by title, date, time and status
+        'CREATE INDEX IF NOT EXISTS idx_meetings_lookup ON meetings(title, date, time, status)',
+        # get_meeting_details lists feedback per meeting
+        'CREATE INDEX IF NOT EXISTS idx_feedback_meeting ON feedback(meeting_id)',
+        # Newest-first listings; the rowid / primary key breaks ties
+        'CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_sentiment_processed ON sentiment_analysis(processed_at, msg_id)',
+    ]),
+    (4, "table change counters", [
+        '''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        *[
+            f"INSERT OR IGNORE INTO table_versions (table_name) VALUES ('{table}')"
+            for table in VERSIONED_TABLES
+        ],
+        # Every write to a listed table bumps its counter, whoever makes it
+        *[
+            f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version AFTER {event} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+            END
+            '''
+            for table in VERSIONED_TABLES
+            for event in ('INSERT', 'UPDATE', 'DELETE')
+        ],
+    ]),
+    (5, "compressed email bodies with snippets", [
+        'ALTER TABLE sentiment_analysis ADD COLUMN body_z BLOB',
+        'ALTER TABLE sentiment_analysis ADD COLUMN snippet TEXT',
+        backfill_compressed_bodies,
+    ]),
+    (6, "full-text search", [
+        # tasks_fts indexes tasks in place (external content), keyed by tasks.id
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+            title, project, assignee,
+            content='tasks', content_rowid='id'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, title, project, assignee)
+            VALUES (new.id, new.title, new.project, new.assignee);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, title, project, assignee)
+            VALUES ('delete', old.id, old.title, old.project, old.assignee);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_update AFTER UPDATE OF title, project, assignee ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, title, project, assignee)
+            VALUES ('delete', old.id, old.title, old.project, old.assignee);
+            INSERT INTO tasks_fts (rowid, title, project, assignee)
+            VALUES (new.id, new.title, new.project, new.assignee);
+        END
+        ''',
+        "INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')",
+        # Bodies are stored compressed, so the email index reads its content
+        # through a view that decompresses them; keyed by the table's rowid
+        '''
+        CREATE VIEW IF NOT EXISTS sentiment_search_source AS
+        SELECT rowid AS doc_id, subject, decompress_body(body_z) AS body FROM sentiment_analysis
+        ''',
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS sentiment_fts USING fts5(
+            subject, body,
+            content='sentiment_search_source', content_rowid='doc_id'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_sentiment_fts_insert AFTER INSERT ON sentiment_analysis BEGIN
+            INSERT INTO sentiment_fts (rowid, subject, body)
+            VALUES (new.rowid, new.subject, decompress_body(new.body_z));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_sentiment_fts_delete AFTER DELETE ON sentiment_analysis BEGIN
+            INSERT INTO sentiment_fts (sentiment_fts, rowid, subject, body)
+            VALUES ('delete', old.rowid, old.subject, decompress_body(old.body_z));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_sentiment_fts_update AFTER UPDATE OF subject, body_z ON sentiment_analysis BEGIN
+            INSERT INTO sentiment_fts (sentiment_fts, rowid, subject, body)
+            VALUES ('delete', old.rowid, old.subject, decompress_body(old.body_z));
+            INSERT INTO sentiment_fts (rowid, subject, body)
+            VALUES (new.rowid, new.subject, decompress_body(new.body_z));
+        END
+        ''',
+        "INSERT INTO sentiment_fts (sentiment_fts) VALUES ('rebuild')",
+    ]),
+    (7, "gmail history checkpoint", [
+        '''
+        CREATE TABLE IF NOT EXISTS gmail_sync (
+            account TEXT PRIMARY KEY,
+            history_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (8, "processed email threads", [
+        'ALTER TABLE processed_emails ADD COLUMN thread_id TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_processed_emails_thread ON processed_emails(thread_id)',
+    ]),
+    (9, "failed email attempts", [
+        '''
+        CREATE TABLE IF NOT EXISTS failed_emails (
+            msg_id TEXT PRIMARY KEY,
+            attempts INTEGER NOT NULL,
+            last_error TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (10, "processed email dates", [
+        # Gmail internalDate, in ms; triage only skips messages later than one handled in their thread
+        'ALTER TABLE processed_emails ADD COLUMN internal_date INTEGER',
+        'DROP INDEX IF EXISTS idx_processed_emails_thread',
+        'CREATE INDEX IF NOT EXISTS idx_processed_emails_thread ON processed_emails(thread_id, internal_date)',
+    ]),
+]
+
+# Full-text indexes tied to rowids, rebuilt after VACUUM (which may renumber them)
+FTS_TABLES = ('tasks_fts', 'sentiment_fts')
+
+# The hot queries and the index each one must use
+QUERY_PLANS = [
+    (
+        "SELECT * FROM meetings WHERE title = ? AND date = ? AND time = ? "
+        "AND status IN ('scheduled', 'rescheduled', 'canceled', 'pending')",
+        ('t', 'd', 't', ),
+        'idx_meetings_lookup'
+    ),
+    ("SELECT * FROM feedback WHERE meeting_id = ?", (1,), 'idx_feedback_meeting'),
+    (
+        "SELECT thread_id, MIN(internal_date) FROM processed_emails "
+        "WHERE thread_id IN (?, ?) AND internal_date IS NOT NULL GROUP BY thread_id",
+        ('a', 'b'),
+        'idx_processed_emails_thread'
+    ),
+    (
+        "SELECT id, msg_id, title, project, assignee, due_date, status, created_at "
+        "FROM tasks WHERE created_at <= ? AND (created_at < ? OR id < ?) "
+        "ORDER BY created_at DESC, id DESC LIMIT ?",
+        ('c', 'c', 1, 101),
+        'idx_tasks_created'
+    ),
+    (
+        "SELECT msg_id, sentiment, confidence, priority, processed_at, subject, snippet "
+        "FROM sentiment_analysis WHERE processed_at <= ? AND (processed_at < ? OR msg_id < ?) "
+        "ORDER BY processed_at DESC, msg_id DESC LIMIT ?",
+        ('p', 'p', 'm', 101),
+        'idx_sentiment_processed'
+    ),
+]
+
+
+def current_version(conn) -> int:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def migrate():
+    """Apply pending migrations, each in its own transaction. Safe to run from several processes."""
+    for version, name, steps in MIGRATIONS:
+        with db.writer() as conn:
+            # Re-read inside the write lock in case another process migrated meanwhile
+            if current_version(conn) >= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+            logger.info(f"Applied migration {version}: {name}")
+
+
+def vacuum():
+    """
+    Compact the database file, then rebuild the full-text indexes against
+    the current rowids. Meant for maintenance windows with no other writers.
+    """
+    # VACUUM cannot run inside a transaction, so it uses a connection of its own
+    conn = db.connect()
+    try:
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    with db.writer() as conn:
+        for table in FTS_TABLES:
+            conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+
+
+def check_query_plans():
+    """Return a list of (query, plan) for hot queries whose plan does not use the expected index."""
+    problems = []
+    cursor = db.reader().cursor()
+    for query, params, index in QUERY_PLANS:
+        cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+        plan = ' | '.join(row[-1] for row in cursor.fetchall())
+        if index not in plan or 'USE TEMP B-TREE' in plan:
+            problems.append((query, plan))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema migrations to the scheduler database.")
+    parser.add_argument("--check", action="store_true", help="verify hot queries use their indexes")
+    parser.add_argument("--vacuum", action="store_true", help="compact the database and rebuild search indexes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+    if args.vacuum:
+        vacuum()
+    if args.check:
+        problems = check_query_plans()
+        for query, plan in problems:
+            print(f"Unexpected plan for: {query}\n  {plan}")
+        if problems:
+            raise SystemExit(1)
+        print("All query plans use their indexes.")
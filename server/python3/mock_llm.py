@@ -0,0 +1,61 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Returned for every chat completion: valid for each extraction prompt, and
+# never a meeting to schedule, so nothing reaches the calendar or the mailbox
+NO_MEETING = {"intent": "none", "title": None, "old_date": None, "old_time": None,
+              "new_date": None, "new_time": None, "attendees": [], "is_sender_required": False}
+
+
+def completion_content(body):
+    if body.get("response_format"):
+        return json.dumps({**NO_MEETING, "tasks": []})
+    if "task" in body["messages"][0]["content"].lower():
+        return "[]"
+    return json.dumps(NO_MEETING)
+
+
+def make_handler(latency):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latency)
+            payload = json.dumps({
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": completion_content(body)}
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the OpenAI chat API; start the server with "
+                    "OPENAI_BASE_URL=http://localhost:<port>/v1 to use it."
+    )
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds each completion takes")
+    args = parser.parse_args()
+    print(f"Mock OpenAI API on http://localhost:{args.port}/v1")
+    ThreadingHTTPServer(("localhost", args.port), make_handler(args.latency)).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import base64
+import json
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# Header carrying the cursor of the next page on list responses
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(*values) -> str:
+    """Opaque cursor for the sort key of the last row on a page."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str], size: int) -> Optional[list]:
+    """The size sort key values of a cursor; 400 unless it holds exactly that many scalars."""
+    if cursor is None:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    # The values are bound as SQL parameters, which only take scalars
+    if any(isinstance(value, bool) or not isinstance(value, (str, int, float)) for value in values):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return values
+
+
+def parse_fields(fields: Optional[str], allowed: List[str]) -> List[str]:
+    """Turn a comma-separated projection into a list of fields, keeping the model's field order."""
+    if not fields:
+        return list(allowed)
+    requested = {field.strip() for field in fields.split(',') if field.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [field for field in allowed if field in requested]
+
+
+def db_timestamp(value: Optional[datetime]) -> Optional[str]:
+    """Format a datetime the way CURRENT_TIMESTAMP stores it, so range filters compare as text."""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def page(rows: list, limit: int):
+    """Split rows fetched with limit + 1 into the page and whether more rows follow."""
+    return rows[:limit], len(rows) > limit
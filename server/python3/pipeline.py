@@ -0,0 +1,164 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Window over which stage throughput is reported
+THROUGHPUT_WINDOW_S = 60.0
+_STOP = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline: a bounded input queue served by its own workers.
+
+    fn takes an item and returns an iterable of items for the next stage
+    (empty to drop it, several to fan out) or None at the last stage. A
+    worker blocks while the next stage's queue is full, so a saturated stage
+    slows everything upstream of it instead of letting queues grow. An item
+    whose fn raises is logged and dropped.
+    """
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1, queue_size: int = 32):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next: Optional['Stage'] = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._processed = 0
+        self._errors = 0
+        self._busy_s = 0.0
+        self._completed_at = deque()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'{self.name}-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, item):
+        """Queue an item, blocking while the stage is saturated."""
+        self.queue.put(item)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                return
+            started = time.monotonic()
+            with self._lock:
+                self._busy += 1
+            try:
+                outputs = self.fn(item)
+                if self.next is not None and outputs is not None:
+                    for output in outputs:
+                        self.next.put(output)
+                failed = False
+            except Exception as e:
+                failed = True
+                logger.error(f"Pipeline stage {self.name} failed on an item: {e}")
+            finally:
+                finished = time.monotonic()
+                with self._lock:
+                    self._busy -= 1
+                    self._busy_s += finished - started
+                    if failed:
+                        self._errors += 1
+                    else:
+                        self._processed += 1
+                        self._completed_at.append(finished)
+                self.queue.task_done()
+
+    def stop(self):
+        """Let the workers finish what is queued, then exit."""
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    @property
+    def processed(self) -> int:
+        with self._lock:
+            return self._processed
+
+    @property
+    def errors(self) -> int:
+        with self._lock:
+            return self._errors
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._completed_at and now - self._completed_at[0] > THROUGHPUT_WINDOW_S:
+                self._completed_at.popleft()
+            done = self._processed + self._errors
+            return {
+                'workers': self.workers,
+                'busy': self._busy,
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'processed': self._processed,
+                'errors': self._errors,
+                'per_second': len(self._completed_at) / THROUGHPUT_WINDOW_S,
+                'mean_latency_s': self._busy_s / done if done else None
+            }
+
+
+class Pipeline:
+    """Stages chained through bounded queues; items enter at the first stage."""
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        for stage, following in zip(stages, stages[1:]):
+            stage.next = following
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                for stage in self.stages:
+                    stage.start()
+                self._started = True
+
+    def put(self, item):
+        """Feed an item, blocking while the first stage is saturated (and so, in turn, any later one)."""
+        self.stages[0].put(item)
+
+    def feed(self, items: Iterable):
+        for item in items:
+            self.put(item)
+
+    def drain(self):
+        """
+        Wait until everything fed so far has left the last stage. Items only
+        move forward, so each queue is empty for good once the ones before it are.
+        """
+        for stage in self.stages:
+            stage.queue.join()
+
+    def stop(self):
+        """Drain, then stop the workers stage by stage."""
+        with self._lock:
+            if not self._started:
+                return
+            for stage in self.stages:
+                stage.stop()
+            self._started = False
+
+    @property
+    def errors(self) -> int:
+        """Items dropped so far because a stage failed on them."""
+        return sum(stage.errors for stage in self.stages)
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
@@ -0,0 +1,226 @@
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import tracemalloc
+from collections import OrderedDict
+from typing import Iterable, List
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Expected number of processed messages; the filter is rebuilt twice as large once exceeded
+BLOOM_CAPACITY = int(os.getenv('PROCESSED_BLOOM_CAPACITY', '1000000'))
+BLOOM_ERROR_RATE = float(os.getenv('PROCESSED_BLOOM_ERROR_RATE', '0.001'))
+# Most recently seen processed IDs, answered without consulting the table
+RECENT_SIZE = int(os.getenv('PROCESSED_RECENT_SIZE', '10000'))
+LOAD_BATCH_SIZE = 10000
+
+
+def bloom_parameters(capacity: int, error_rate: float):
+    """Bit count and hash count of a Bloom filter holding capacity items at error_rate."""
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, using double hashing of one BLAKE2b digest."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits, self.hashes = bloom_parameters(capacity, error_rate)
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._array)
+
+
+class ProcessedMessages:
+    """
+    In-memory membership test for processed_emails.
+
+    A Bloom filter over every processed msg_id answers "never processed"
+    without I/O, and a bounded set of recent IDs answers most duplicates
+    the same way. Only the rare probable-positive outside the recent set is
+    confirmed against the table. Rows written by other processes are only
+    seen after refresh(), which reads processed_emails past the last seen id,
+    so callers refresh before each batch they filter.
+    """
+
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE, recent_size=RECENT_SIZE):
+        self.error_rate = error_rate
+        self.recent_size = recent_size
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._recent = OrderedDict()
+        self._count = 0
+        self._last_row_id = 0
+        self._stats = {'negatives': 0, 'recent_hits': 0, 'confirmed': 0, 'false_positives': 0}
+
+    def refresh(self):
+        """Add processed_emails rows inserted since the last load, by this or any other process."""
+        with self._lock:
+            cursor = db.reader().execute(
+                'SELECT id, msg_id FROM processed_emails WHERE id > ? ORDER BY id', (self._last_row_id,)
+            )
+            while True:
+                rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+                if not rows:
+                    break
+                for row_id, msg_id in rows:
+                    # Our own inserts were added already when they committed
+                    if msg_id not in self._recent:
+                        self._add(msg_id)
+                self._last_row_id = rows[-1][0]
+            if self._count > self._bloom.capacity:
+                self._rebuild()
+
+    def _rebuild(self):
+        """Reload into a filter twice the current count once the false positive rate would climb."""
+        logger.info(f"Rebuilding processed message filter for {self._count} IDs")
+        self._bloom = BloomFilter(self._count * 2, self.error_rate)
+        self._count = 0
+        cursor = db.reader().execute('SELECT msg_id FROM processed_emails WHERE id <= ?', (self._last_row_id,))
+        while True:
+            rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+            if not rows:
+                break
+            for (msg_id,) in rows:
+                self._bloom.add(msg_id)
+                self._count += 1
+
+    def _add(self, msg_id: str):
+        self._bloom.add(msg_id)
+        self._count += 1
+        self._remember(msg_id)
+
+    def _remember(self, msg_id: str):
+        self._recent[msg_id] = None
+        self._recent.move_to_end(msg_id)
+        while len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
+
+    def add(self, msg_id: str):
+        """Record a message marked processed by this process, once its transaction committed."""
+        with self._lock:
+            if msg_id not in self._recent:
+                self._add(msg_id)
+
+    def _probably_processed(self, msg_id: str):
+        """True or False when memory is enough to tell, None when the table has to decide."""
+        if msg_id not in self._bloom:
+            self._stats['negatives'] += 1
+            return False
+        if msg_id in self._recent:
+            self._stats['recent_hits'] += 1
+            return True
+        return None
+
+    def __contains__(self, msg_id: str) -> bool:
+        return not self.filter_unprocessed([msg_id])
+
+    def filter_unprocessed(self, msg_ids: Iterable[str]) -> List[str]:
+        """Return the msg_ids not processed yet, keeping their order."""
+        msg_ids = list(msg_ids)
+        with self._lock:
+            verdicts = {msg_id: self._probably_processed(msg_id) for msg_id in msg_ids}
+        unsure = [msg_id for msg_id, verdict in verdicts.items() if verdict is None]
+        if unsure:
+            rows = db.query(
+                f"SELECT msg_id FROM processed_emails WHERE msg_id IN ({','.join('?' * len(unsure))})", unsure
+            )
+            confirmed = {row[0] for row in rows}
+            with self._lock:
+                for msg_id in unsure:
+                    verdicts[msg_id] = msg_id in confirmed
+                    if msg_id in confirmed:
+                        self._stats['confirmed'] += 1
+                        self._remember(msg_id)
+                    else:
+                        self._stats['false_positives'] += 1
+        return [msg_id for msg_id in msg_ids if not verdicts[msg_id]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ids': self._count,
+                'bloom_capacity': self._bloom.capacity,
+                'bloom_bytes': self._bloom.nbytes,
+                'bloom_hashes': self._bloom.hashes,
+                'recent_ids': len(self._recent),
+                **self._stats
+            }
+
+
+def _measure(build):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        built = build()
+        return built, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def memory_report(ids: int, error_rate=BLOOM_ERROR_RATE, recent_size=RECENT_SIZE):
+    """Measure the memory taken by ids synthetic Gmail-style IDs, in the filter and in a plain set."""
+    msg_ids = [f'{0x18f0000000000000 + i:016x}' for i in range(ids)]
+
+    def build_filter():
+        processed = ProcessedMessages(capacity=ids, error_rate=error_rate, recent_size=recent_size)
+        with processed._lock:
+            for msg_id in msg_ids:
+                processed._add(msg_id)
+        return processed
+
+    processed, filter_bytes = _measure(build_filter)
+    # The set holds its own copies of the strings, as one loaded from the table would
+    _, set_bytes = _measure(lambda: {msg_id.encode().decode() for msg_id in msg_ids})
+    return {
+        'ids': ids,
+        'error_rate': error_rate,
+        'bloom_bytes': processed._bloom.nbytes,
+        'total_bytes': filter_bytes,
+        'plain_set_bytes': set_bytes
+    }
+
+
+_processed = None
+_processed_lock = threading.Lock()
+
+
+def get_processed_messages() -> ProcessedMessages:
+    """Return the process-wide processed message set, loading it from the table on first use."""
+    global _processed
+    with _processed_lock:
+        if _processed is None:
+            _processed = ProcessedMessages()
+            _processed.refresh()
+        return _processed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report memory used by the processed message set.")
+    parser.add_argument("--ids", type=int, default=1000000)
+    args = parser.parse_args()
+    print(json.dumps(memory_report(args.ids), indent=2))
@@ -0,0 +1,52 @@
+import argparse
+import time
+import uuid
+from datetime import datetime, timezone
+
+import requests
+
+from gmail_push import encode_notification
+
+
+def push_message(email_address, history_id, subscription):
+    """A Gmail notification wrapped the way a Pub/Sub push subscription delivers it."""
+    message_id = uuid.uuid4().int % 10 ** 16
+    return {
+        "message": {
+            "data": encode_notification(email_address, history_id),
+            "messageId": str(message_id),
+            "message_id": str(message_id),
+            "publishTime": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+            "attributes": {},
+        },
+        "subscription": subscription,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for Pub/Sub: push Gmail watch notifications to the receiver endpoint."
+    )
+    parser.add_argument("--url", default="http://localhost:8000/gmail/push")
+    parser.add_argument("--token", help="verification token the endpoint expects (GMAIL_PUSH_TOKEN)")
+    parser.add_argument("--email", default="me@example.com")
+    parser.add_argument("--history-id", type=int, required=True,
+                        help="history ID of the first notification; bursts count up from it")
+    parser.add_argument("--count", type=int, default=1, help="notifications to send")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between notifications")
+    parser.add_argument("--subscription", default="projects/local/subscriptions/gmail-push")
+    args = parser.parse_args()
+
+    params = {"token": args.token} if args.token else None
+    session = requests.Session()
+    for i in range(args.count):
+        response = session.post(
+            args.url, params=params, json=push_message(args.email, args.history_id + i, args.subscription)
+        )
+        print(f"historyId={args.history_id + i} -> {response.status_code}")
+        if args.interval:
+            time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
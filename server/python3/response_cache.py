@@ -0,0 +1,124 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+from fastapi import Response
+
+import db
+
+# Rendered responses kept in memory; least recently used ones are evicted beyond it
+MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '512'))
+
+
+def table_versions(tables: Sequence[str]) -> tuple:
+    """Current change counters of tables, maintained by triggers on every write."""
+    placeholders = ', '.join('?' for _ in tables)
+    rows = db.query(
+        f'SELECT table_name, version FROM table_versions WHERE table_name IN ({placeholders})', tuple(tables)
+    )
+    versions = dict(rows)
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses the weak comparison, so W/ prefixes are ignored."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(','))
+    return any((tag[2:] if tag.startswith('W/') else tag) == etag for tag in candidates)
+
+
+class CachedResponse:
+    """A rendered response body with its strong ETag."""
+
+    def __init__(self, response: Response):
+        self.body = response.body
+        self.status_code = response.status_code
+        self.media_type = response.media_type
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+        self.headers = {
+            name: value for name, value in response.headers.items()
+            if name not in ('content-length', 'content-type')
+        }
+        self.headers['ETag'] = self.etag
+
+    def respond(self, if_none_match: Optional[str]) -> Response:
+        if etag_matches(if_none_match, self.etag):
+            return Response(status_code=304, headers={'ETag': self.etag})
+        return Response(self.body, status_code=self.status_code, media_type=self.media_type, headers=self.headers)
+
+
+class ResponseCache:
+    """
+    In-memory cache of rendered GET responses.
+
+    Keys combine the path, the query parameters and the change counters of
+    the tables the response reads, so any write to those tables makes the
+    next request render afresh and entries never need explicit invalidation.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._not_modified = 0
+
+    async def serve(self, request, tables: Sequence[str], render) -> Response:
+        """
+        Answer request from the cache, awaiting render() for a fresh response
+        on a miss, and with 304 Not Modified when If-None-Match matches.
+        """
+        # Versions are read before rendering, so an entry is never older than its key
+        versions = await db.run(table_versions, tables)
+        key = (request.url.path, tuple(sorted(request.query_params.multi_items())), versions)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+            else:
+                self._misses += 1
+
+        if entry is None:
+            response = await render()
+            if response.status_code != 200:
+                return response
+            entry = CachedResponse(response)
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        if_none_match = request.headers.get('if-none-match')
+        if etag_matches(if_none_match, entry.etag):
+            with self._lock:
+                self._not_modified += 1
+        return entry.respond(if_none_match)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'not_modified': self._not_modified
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,140 @@
+import html
+import sqlite3
+from typing import Optional
+
+from fastapi import HTTPException
+
+import db
+from pagination import encode_cursor, page
+
+HIGHLIGHT_OPEN = '<mark>'
+HIGHLIGHT_CLOSE = '</mark>'
+# SQLite marks matches with these private-use characters; the text around them
+# is HTML-escaped before they become the tags above
+_MATCH_OPEN = '\ue000'
+_MATCH_CLOSE = '\ue001'
+# Tokens around the best match in a body snippet
+SNIPPET_TOKENS = 16
+
+
+def _run(sql: str, params: list, limit: int):
+    """Run a ranked search query, turning errors in the MATCH expression into a 400."""
+    try:
+        rows = db.query(sql, params + [limit + 1])
+    except sqlite3.OperationalError as e:
+        # Malformed queries fail in many ways ("fts5: syntax error", "unterminated
+        # string", "no such column: foo" for foo:bar); only a busy database is ours
+        if 'locked' in str(e):
+            raise
+        raise HTTPException(status_code=400, detail=f"Invalid search query: {e}")
+    return page(rows, limit)
+
+
+def _highlighted(text: Optional[str]) -> Optional[str]:
+    """HTML-escape stored text and turn the match markers SQLite added into highlight tags."""
+    if text is None:
+        return None
+    return html.escape(text).replace(_MATCH_OPEN, HIGHLIGHT_OPEN).replace(_MATCH_CLOSE, HIGHLIGHT_CLOSE)
+
+
+def _keyset(table: str, after: Optional[list]):
+    """Condition continuing after the (rank, rowid) of the last result of the previous page."""
+    if not after:
+        return [], []
+    return (
+        [f"(bm25({table}) > ? OR (bm25({table}) = ? AND {table}.rowid > ?))"],
+        [after[0], after[0], after[1]]
+    )
+
+
+def search_emails(q: str, limit: int, after=None, priority=None, sentiment=None, since=None, until=None):
+    """
+    Best matching emails for an FTS5 query over subject and body, with the
+    matches highlighted in the subject and in a snippet of the body.
+    """
+    conditions, params = _keyset('sentiment_fts', after)
+    if priority:
+        conditions.append("s.priority = ?")
+        params.append(priority)
+    if sentiment:
+        conditions.append("s.sentiment = ?")
+        params.append(sentiment)
+    if since:
+        conditions.append("s.processed_at >= ?")
+        params.append(since)
+    if until:
+        conditions.append("s.processed_at < ?")
+        params.append(until)
+    where = ''.join(f" AND {condition}" for condition in conditions)
+
+    rows, more = _run(f'''
+        SELECT sentiment_fts.rowid, bm25(sentiment_fts), s.msg_id,
+               highlight(sentiment_fts, 0, '{_MATCH_OPEN}', '{_MATCH_CLOSE}'),
+               snippet(sentiment_fts, 1, '{_MATCH_OPEN}', '{_MATCH_CLOSE}', '…', {SNIPPET_TOKENS}),
+               s.sentiment, s.confidence, s.priority, s.processed_at
+        FROM sentiment_fts
+        JOIN sentiment_analysis s ON s.rowid = sentiment_fts.rowid
+        WHERE sentiment_fts MATCH ?{where}
+        ORDER BY bm25(sentiment_fts), sentiment_fts.rowid
+        LIMIT ?
+    ''', [q] + params, limit)
+    results = [
+        {
+            "msg_id": row[2],
+            "subject": _highlighted(row[3]),
+            "snippet": _highlighted(row[4]),
+            "sentiment": row[5],
+            "confidence": row[6],
+            "priority": row[7],
+            "processed_at": row[8],
+            "score": row[1]
+        }
+        for row in rows
+    ]
+    next_cursor = encode_cursor(rows[-1][1], rows[-1][0]) if more else None
+    return results, next_cursor
+
+
+def search_tasks(q: str, limit: int, after=None, status=None, project=None, since=None, until=None):
+    """Best matching tasks for an FTS5 query over title, project and assignee, with the title highlighted."""
+    conditions, params = _keyset('tasks_fts', after)
+    if status:
+        conditions.append("t.status = ?")
+        params.append(status)
+    if project:
+        conditions.append("t.project = ?")
+        params.append(project)
+    if since:
+        conditions.append("t.created_at >= ?")
+        params.append(since)
+    if until:
+        conditions.append("t.created_at < ?")
+        params.append(until)
+    where = ''.join(f" AND {condition}" for condition in conditions)
+
+    rows, more = _run(f'''
+        SELECT tasks_fts.rowid, bm25(tasks_fts), t.msg_id,
+               highlight(tasks_fts, 0, '{_MATCH_OPEN}', '{_MATCH_CLOSE}'),
+               t.project, t.assignee, t.due_date, t.status, t.created_at
+        FROM tasks_fts
+        JOIN tasks t ON t.id = tasks_fts.rowid
+        WHERE tasks_fts MATCH ?{where}
+        ORDER BY bm25(tasks_fts), tasks_fts.rowid
+        LIMIT ?
+    ''', [q] + params, limit)
+    results = [
+        {
+            "id": row[0],
+            "msg_id": row[2],
+            "title": _highlighted(row[3]),
+            "project": row[4],
+            "assignee": row[5],
+            "dueDate": row[6],
+            "status": row[7],
+            "created_at": row[8],
+            "score": row[1]
+        }
+        for row in rows
+    ]
+    next_cursor = encode_cursor(rows[-1][1], rows[-1][0]) if more else None
+    return results, next_cursor
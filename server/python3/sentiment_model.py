@@ -0,0 +1,132 @@
+import logging
+import os
+import random
+import threading
+
+import ray
+
+from micro_batcher import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+ACTOR_NAME = 'sentiment_model'
+# Number of actors hosting a copy of the model
+REPLICAS = int(os.getenv('SENTIMENT_MODEL_REPLICAS', '1'))
+
+
+@ray.remote(max_concurrency=64)
+class SentimentModel:
+    """
+    Long-lived holder of the sentiment transformer.
+
+    The actor is threaded so concurrent analyze() calls land in the same
+    micro-batcher and share forward passes.
+    """
+
+    def __init__(self):
+        from transformers import pipeline
+
+        self.pipeline = pipeline("sentiment-analysis")
+        # Longest input, in tokens, the model accepts
+        self.max_tokens = min(self.pipeline.tokenizer.model_max_length, 512)
+        self.batcher = MicroBatcher(
+            self._run_batch,
+            max_batch_size=int(os.getenv('SENTIMENT_MAX_BATCH_SIZE', '16')),
+            max_wait_ms=float(os.getenv('SENTIMENT_MAX_WAIT_MS', '20')),
+            name='sentiment-batcher'
+        )
+        logger.info("Sentiment model loaded.")
+
+    def _run_batch(self, texts):
+        """Run one padded, truncated forward pass over a batch of email texts."""
+        return self.pipeline(
+            texts,
+            batch_size=len(texts),
+            padding=True,
+            truncation=True,
+            max_length=self.max_tokens
+        )
+
+    def ready(self):
+        return True
+
+    def analyze(self, text):
+        return self.batcher(text)
+
+    def stats(self):
+        return self.batcher.stats()
+
+
+_ready = False
+_ready_refs = {}
+_actors = {}
+_lock = threading.Lock()
+
+
+def _actor_name(replica):
+    return f"{ACTOR_NAME}_{replica}"
+
+
+def get_sentiment_model():
+    """
+    Return a handle to a model actor, creating it on first use. Handles are
+    kept, so only the first call per replica looks the actor up. The actors
+    share the fate of the process that created them, so a redeploy always
+    starts them afresh with the current code.
+    """
+    replica = random.randrange(REPLICAS)
+    with _lock:
+        actor = _actors.get(replica)
+        if actor is None:
+            actor = SentimentModel.options(name=_actor_name(replica), get_if_exists=True).remote()
+            _actors[replica] = actor
+            _ready_refs.setdefault(replica, actor.ready.remote())
+    return actor
+
+
+def sentiment_model_ready():
+    """True once at least one model actor has finished loading; never blocks or creates actors."""
+    global _ready
+    if _ready:
+        return True
+    for replica in range(REPLICAS):
+        with _lock:
+            ref = _ready_refs.get(replica)
+        if ref is None:
+            try:
+                ref = ray.get_actor(_actor_name(replica)).ready.remote()
+            except ValueError:
+                continue
+            with _lock:
+                _ready_refs[replica] = ref
+        done, _ = ray.wait([ref], timeout=0)
+        if not done:
+            continue
+        # A ref also completes when the actor died loading the model
+        try:
+            loaded = ray.get(ref)
+        except Exception as e:
+            logger.warning(f"Sentiment model {_actor_name(replica)} failed to load: {e}")
+            with _lock:
+                # Let the next get_sentiment_model() start a fresh actor
+                if _ready_refs.get(replica) is ref:
+                    del _ready_refs[replica]
+                    _actors.pop(replica, None)
+            continue
+        if loaded is True:
+            _ready = True
+            return True
+    return False
+
+
+def sentiment_model_stats():
+    """Batching stats from every running model actor."""
+    stats = {}
+    for replica in range(REPLICAS):
+        try:
+            actor = ray.get_actor(_actor_name(replica))
+            stats[_actor_name(replica)] = ray.get(actor.stats.remote(), timeout=5)
+        except (ValueError, ray.exceptions.GetTimeoutError):
+            # Not created yet, or still loading the model
+            continue
+    return stats
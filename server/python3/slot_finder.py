@@ -0,0 +1,79 @@
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+# Working-hours window (UTC hours) in which free slots are offered
+WORKING_HOURS = (
+    int(os.getenv('WORKING_HOURS_START', '9')),
+    int(os.getenv('WORKING_HOURS_END', '17'))
+)
+# Candidate slot starts are aligned to this many minutes from the start of the working day
+SLOT_GRANULARITY = timedelta(minutes=int(os.getenv('SLOT_GRANULARITY_MINUTES', '30')))
+# Free time kept before and after every busy interval
+BUFFER = timedelta(minutes=15)
+
+Interval = Tuple[datetime, datetime]
+
+
+def merge_intervals(intervals: List[Interval], buffer: timedelta = BUFFER) -> List[Interval]:
+    """Pad intervals by the buffer, sort them, and merge any that overlap or touch."""
+    merged = []
+    for start, end in sorted((start - buffer, end + buffer) for start, end in intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _align(moment: datetime, origin: datetime, granularity: timedelta) -> datetime:
+    """Round moment up to the next granularity step counted from origin."""
+    steps = -((origin - moment) // granularity)
+    return origin + max(steps, 0) * granularity
+
+
+def find_free_slots(
+    busy: List[Interval],
+    window_start: datetime,
+    window_end: datetime,
+    duration: timedelta,
+    k: int = 3,
+    preferred: Optional[datetime] = None,
+    working_hours: Tuple[int, int] = WORKING_HOURS,
+    granularity: timedelta = SLOT_GRANULARITY,
+    buffer: timedelta = BUFFER
+) -> List[datetime]:
+    """
+    Sweep the merged busy intervals once and return up to k free slot starts.
+
+    Slots lie inside the working hours of each day in [window_start, window_end]
+    and keep the buffer clear around every busy interval. When a preferred time
+    is given, the k slots closest to it are returned; otherwise the earliest k.
+    """
+    merged = merge_intervals(busy, buffer)
+    free = []
+    j = 0
+
+    day = window_start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < window_end:
+        work_start = day + timedelta(hours=working_hours[0])
+        work_end = min(day + timedelta(hours=working_hours[1]), window_end)
+        candidate = _align(max(work_start, window_start), work_start, granularity)
+
+        while candidate + duration <= work_end:
+            slot_end = candidate + duration
+            # Busy intervals are sorted, so anything ending before the candidate is done with
+            while j < len(merged) and merged[j][1] <= candidate:
+                j += 1
+            if j < len(merged) and merged[j][0] < slot_end:
+                candidate = _align(merged[j][1], work_start, granularity)
+                continue
+            free.append(candidate)
+            candidate += granularity
+
+        day += timedelta(days=1)
+
+    if preferred is not None:
+        free = sorted(sorted(free, key=lambda slot: abs(slot - preferred))[:k])
+    return free[:k]
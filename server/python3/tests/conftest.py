@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# The server modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep tests off the real database; db reads the path when first imported
+os.environ.setdefault('SCHEDULER_DB_PATH', os.path.join(tempfile.mkdtemp(), 'scheduler.db'))
@@ -0,0 +1,82 @@
+import json
+import re
+from urllib.parse import parse_qs, urlparse
+
+import httplib2
+import pytest
+from googleapiclient.discovery import build
+
+from gmail_batch import fetch_messages, unique_ids
+
+BOUNDARY = 'batch_response_boundary'
+
+
+class FakeBatchHttp:
+    """
+    Transport answering Gmail batch requests the way the batch endpoint
+    does: one application/http part per call, in a multipart/mixed body.
+    Message IDs in statuses get that HTTP status instead of the message.
+    """
+
+    def __init__(self, statuses=None):
+        self.statuses = statuses or {}
+        self.batches = []
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        request_boundary = re.search(r'boundary="?([^";]+)', headers['content-type']).group(1)
+        calls = []
+        for part in body.split(f'--{request_boundary}')[1:-1]:
+            content_id = re.search(r'Content-ID: <(.+?)>', part, re.IGNORECASE).group(1)
+            url = urlparse(re.search(r'^GET (\S+)', part, re.MULTILINE).group(1))
+            calls.append((content_id, url.path.rsplit('/', 1)[-1], parse_qs(url.query)))
+        self.batches.append({'uri': uri, 'calls': calls})
+
+        parts = []
+        for content_id, msg_id, query in calls:
+            status = self.statuses.get(msg_id, 200)
+            payload = {'id': msg_id, 'format': query['format'][0]} if status == 200 else {'error': {'code': status}}
+            parts.append(
+                f'--{BOUNDARY}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n'
+                f'HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n\r\n{json.dumps(payload)}\r\n'
+            )
+        content = ''.join(parts) + f'--{BOUNDARY}--'
+        response = httplib2.Response({'status': 200, 'content-type': f'multipart/mixed; boundary={BOUNDARY}'})
+        return response, content.encode()
+
+
+@pytest.fixture(scope='module')
+def service():
+    return build('gmail', 'v1', developerKey='test', static_discovery=True)
+
+
+def test_unique_ids_keeps_first_occurrences_in_order():
+    assert unique_ids(['b', 'a', 'b', 'c', 'a']) == ['b', 'a', 'c']
+
+
+def test_messages_are_fetched_through_the_given_transport(service):
+    http = FakeBatchHttp()
+    messages = fetch_messages(service, ['a', 'b', 'a'], http=http, batch_uri='http://gmail.test/batch')
+    assert messages == {'a': {'id': 'a', 'format': 'full'}, 'b': {'id': 'b', 'format': 'full'}}
+    assert [batch['uri'] for batch in http.batches] == ['http://gmail.test/batch']
+    assert [msg_id for _, msg_id, _ in http.batches[0]['calls']] == ['a', 'b']
+
+
+def test_ids_are_split_into_batches_of_batch_size(service):
+    http = FakeBatchHttp()
+    messages = fetch_messages(service, [str(i) for i in range(5)], http=http, batch_size=2)
+    assert len(messages) == 5
+    assert [len(batch['calls']) for batch in http.batches] == [2, 2, 1]
+
+
+def test_get_arguments_are_passed_on_to_every_call(service):
+    http = FakeBatchHttp()
+    fetch_messages(service, ['a'], format='metadata', http=http, metadataHeaders=['From', 'Subject'])
+    _, _, query = http.batches[0]['calls'][0]
+    assert query['format'] == ['metadata']
+    assert query['metadataHeaders'] == ['From', 'Subject']
+
+
+def test_failed_calls_are_left_out(service):
+    http = FakeBatchHttp(statuses={'b': 404, 'c': 500})
+    messages = fetch_messages(service, ['a', 'b', 'c'], http=http)
+    assert list(messages) == ['a']
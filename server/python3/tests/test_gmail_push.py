@@ -0,0 +1,150 @@
+import asyncio
+import base64
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import ingestion
+from gmail_push import decode_notification, encode_notification
+from ingestion import IngestionScheduler
+from migrations import migrate
+
+TOPIC = 'projects/test/topics/gmail'
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        time.sleep(0.01)
+
+
+def test_notifications_round_trip():
+    assert decode_notification(encode_notification('me@example.com', 123)) == {
+        'emailAddress': 'me@example.com', 'historyId': 123
+    }
+
+
+@pytest.mark.parametrize('data', ['not base64!', base64.b64encode(b'[1]').decode(),
+                                  base64.b64encode(b'{"emailAddress": "me@example.com"}').decode()])
+def test_malformed_notifications_are_rejected(data):
+    with pytest.raises(ValueError):
+        decode_notification(data)
+
+
+@pytest.fixture
+def push_scheduler(monkeypatch):
+    """A push-mode scheduler whose polls and watch renewals are only counted."""
+    migrate()
+    monkeypatch.setattr(ingestion, 'PUSH_COALESCE_S', 0.2)
+    calls = {'polls': 0, 'watches': 0, 'watch_failures': 0}
+
+    def watch(service, topic, user_id='me'):
+        calls['watches'] += 1
+        if calls['watch_failures']:
+            calls['watch_failures'] -= 1
+            raise RuntimeError("Permission denied on topic")
+        return time.time() + 7 * 24 * 3600
+    monkeypatch.setattr(ingestion, 'watch', watch)
+
+    scheduler = IngestionScheduler(lambda: None, push_topic=TOPIC, min_interval=0.05, max_interval=0.05)
+
+    def poll_once():
+        calls['polls'] += 1
+        return 0
+    scheduler.poll_once = poll_once
+    scheduler.calls = calls
+    yield scheduler
+    scheduler.stop()
+
+
+def test_stale_notifications_do_not_wake_the_loop(push_scheduler):
+    push_scheduler._checkpoint = 100
+    push_scheduler.notify(90)
+    push_scheduler.notify('100')
+    assert not push_scheduler._wake.is_set()
+    push_scheduler.notify(101)
+    assert push_scheduler._wake.is_set()
+    stats = push_scheduler.stats()
+    assert stats['notifications'] == 3
+    assert stats['stale_notifications'] == 2
+
+
+def test_a_burst_of_notifications_costs_one_poll(push_scheduler):
+    push_scheduler.start()
+    wait_for(lambda: push_scheduler.calls['polls'] == 1)
+    # With the watch active the loop sleeps for the safety interval, so only notifications wake it
+    assert push_scheduler.stats()['push_active']
+    assert push_scheduler.interval == ingestion.SAFETY_POLL_INTERVAL
+    for history_id in range(200, 250):
+        push_scheduler.notify(history_id)
+    wait_for(lambda: push_scheduler.calls['polls'] == 2)
+    time.sleep(0.5)
+    assert push_scheduler.calls['polls'] == 2
+    assert push_scheduler.calls['watches'] == 1
+
+
+def test_polling_stays_adaptive_while_the_watch_fails(push_scheduler):
+    push_scheduler.calls['watch_failures'] = 2
+    push_scheduler.start()
+    wait_for(lambda: push_scheduler.calls['watches'] == 3)
+    stats = push_scheduler.stats()
+    assert stats['watch_errors'] == 2
+    assert stats['watch_renewals'] == 1
+    assert push_scheduler.calls['polls'] >= 3
+
+
+@pytest.fixture(scope='module')
+def main():
+    import main
+    return main
+
+
+class RecordingScheduler:
+    def __init__(self):
+        self.notified = []
+
+    def notify(self, history_id=None):
+        self.notified.append(history_id)
+
+
+@pytest.fixture
+def push(main, monkeypatch):
+    """Call the /gmail/push handler directly with notification data and a token."""
+    scheduler = RecordingScheduler()
+    monkeypatch.setattr(main, 'PUSH_TOKEN', 'secret')
+    monkeypatch.setattr(main, 'get_ingestion_scheduler', lambda: scheduler)
+
+    def send(data, token='secret'):
+        notification = main.PushNotification(message=main.PubSubMessage(data=data))
+        return asyncio.run(main.gmail_push(notification, token=token))
+    send.scheduler = scheduler
+    return send
+
+
+def test_push_notifies_the_scheduler(push):
+    response = push(encode_notification('me@example.com', 321))
+    assert response.status_code == 204
+    assert push.scheduler.notified == [321]
+
+
+def test_push_with_a_wrong_token_is_refused(push):
+    with pytest.raises(HTTPException) as error:
+        push(encode_notification('me@example.com', 321), token='guess')
+    assert error.value.status_code == 403
+    assert push.scheduler.notified == []
+
+
+def test_malformed_push_is_acknowledged(push):
+    response = push('not base64!')
+    assert response.status_code == 204
+    assert push.scheduler.notified == []
+
+
+def test_push_without_ingestion_is_retried(main, push, monkeypatch):
+    monkeypatch.setattr(main, 'get_ingestion_scheduler', lambda: None)
+    with pytest.raises(HTTPException) as error:
+        push(encode_notification('me@example.com', 321))
+    assert error.value.status_code == 503
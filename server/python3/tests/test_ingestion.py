@@ -0,0 +1,284 @@
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import db
+import ingestion
+import processed_messages
+from agents import mark_skipped
+from ingestion import IngestionScheduler, load_history_id, save_history_id
+from migrations import migrate
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({'status': status}), b'{}')
+
+
+def message(msg_id, thread_id=None, internal_date=1000, sender='alice@example.com'):
+    return {
+        'id': msg_id,
+        'threadId': thread_id or f'thread-{msg_id}',
+        'internalDate': str(internal_date),
+        'payload': {
+            'mimeType': 'text/plain',
+            'headers': [{'name': 'From', 'value': sender}, {'name': 'Subject', 'value': f'About {msg_id}'}],
+            'body': {'data': 'aGVsbG8='}
+        }
+    }
+
+
+class Request:
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    def execute(self):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+
+class FakeGmail:
+    """Stands in for the Gmail API service: the profile, the history feed and single message gets."""
+
+    def __init__(self, history_id='200', profile_history_id='100'):
+        self.messages_by_id = {}
+        self.added = []
+        self.history_id = history_id
+        self.profile_history_id = profile_history_id
+        self.history_error = None
+        # Messages whose part of a full batch fetch fails, leaving the single get to decide
+        self.batch_failures = set()
+        self.get_errors = {}
+        self.gets = []
+
+    def users(self):
+        return self
+
+    def history(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def getProfile(self, userId):
+        return Request({'historyId': self.profile_history_id})
+
+    def list(self, **kwargs):
+        if self.history_error:
+            return Request(http_error(self.history_error))
+        records = [{'messagesAdded': [{'message': {'id': msg_id}}]} for msg_id in self.added]
+        return Request({'history': records, 'historyId': self.history_id})
+
+    def get(self, userId, id, format, **kwargs):
+        self.gets.append(id)
+        if id in self.get_errors:
+            return Request(http_error(self.get_errors[id]))
+        return Request(self.messages_by_id[id])
+
+
+@pytest.fixture
+def gmail(monkeypatch):
+    """A fake mailbox behind a stubbed batch fetch, on an empty schema."""
+    migrate()
+    with db.writer() as conn:
+        for table in ('processed_emails', 'failed_emails', 'gmail_sync'):
+            conn.execute(f'DELETE FROM {table}')
+    monkeypatch.setattr(processed_messages, '_processed', None)
+
+    service = FakeGmail()
+
+    def fetch_messages(service_, msg_ids, format='full', **kwargs):
+        return {
+            msg_id: service.messages_by_id[msg_id] for msg_id in msg_ids
+            if not (format == 'full' and msg_id in service.batch_failures)
+        }
+    monkeypatch.setattr(ingestion, 'fetch_messages', fetch_messages)
+    return service
+
+
+class Calls(list):
+    def __init__(self):
+        super().__init__()
+        self.failing = set()
+
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    """Record analyzed msg_ids, failing those in analyzed.failing, instead of calling the models."""
+    calls = Calls()
+
+    def analyze_decoded_email(email):
+        calls.append(email['msg_id'])
+        if email['msg_id'] in calls.failing:
+            raise RuntimeError(f"Analysis of email {email['msg_id']} failed")
+        return {**email, 'sentiment': None, 'tasks': []}
+    monkeypatch.setattr(ingestion, 'analyze_decoded_email', analyze_decoded_email)
+    return calls
+
+
+@pytest.fixture
+def scheduler(gmail):
+    schedulers = []
+
+    def make(**kwargs):
+        made = IngestionScheduler(lambda: gmail, push_topic=None, **kwargs)
+        schedulers.append(made)
+        return made
+    yield make
+    for made in schedulers:
+        made.stop()
+
+
+def processed_ids():
+    return {row[0] for row in db.query('SELECT msg_id FROM processed_emails')}
+
+
+def add_mail(gmail, *messages):
+    for m in messages:
+        gmail.messages_by_id[m['id']] = m
+        gmail.added.append(m['id'])
+
+
+def test_first_poll_starts_from_the_current_history_id(gmail, scheduler, analyzed):
+    add_mail(gmail, message('a'))
+    assert scheduler().poll_once() == 0
+    assert load_history_id() == 100
+    assert analyzed == []
+
+
+def test_poll_processes_new_mail_and_advances_the_checkpoint(gmail, scheduler, analyzed):
+    save_history_id(100)
+    add_mail(gmail, message('a'), message('b'))
+    poller = scheduler()
+    assert poller.poll_once() == 2
+    assert load_history_id() == 200
+    assert processed_ids() == {'a', 'b'}
+    assert poller.stats()['held'] == 0
+
+
+def test_failed_message_holds_the_checkpoint_until_it_succeeds(gmail, scheduler, analyzed):
+    save_history_id(100)
+    add_mail(gmail, message('a'), message('b'))
+    analyzed.failing = {'b'}
+    poller = scheduler()
+    assert poller.poll_once() == 1
+    assert load_history_id() == 100
+    assert poller.stats()['held'] == 1
+
+    # The retry reads the same history; only the failed message is analyzed again
+    analyzed.failing = set()
+    del analyzed[:]
+    assert poller.poll_once() == 1
+    assert analyzed == ['b']
+    assert load_history_id() == 200
+    assert db.query('SELECT * FROM failed_emails') == []
+
+
+def test_message_failing_every_attempt_is_given_up_on(gmail, scheduler, analyzed):
+    save_history_id(100)
+    add_mail(gmail, message('a'), message('b'))
+    analyzed.failing = {'b'}
+    poller = scheduler(max_attempts=2)
+    poller.poll_once()
+    assert load_history_id() == 100
+
+    poller.poll_once()
+    assert load_history_id() == 200
+    assert 'b' in processed_ids()
+    assert poller.stats()['skipped'] == {'failed': 1}
+    assert db.query('SELECT msg_id, attempts FROM failed_emails') == [('b', 2)]
+
+    # Later polls leave it alone
+    del analyzed[:]
+    poller.poll_once()
+    assert analyzed == []
+
+
+def test_expired_checkpoint_restarts_from_the_current_history_id(gmail, scheduler, analyzed):
+    save_history_id(50)
+    gmail.history_error = 404
+    gmail.profile_history_id = '300'
+    poller = scheduler()
+    assert poller.poll_once() == 0
+    assert load_history_id() == 300
+    assert poller.stats()['resets'] == 1
+
+
+def test_history_errors_other_than_expiry_propagate(gmail, scheduler, analyzed):
+    save_history_id(100)
+    gmail.history_error = 500
+    with pytest.raises(HttpError):
+        scheduler().poll_once()
+    assert load_history_id() == 100
+
+
+def test_deleted_message_is_skipped_for_good(gmail, scheduler, analyzed):
+    save_history_id(100)
+    add_mail(gmail, message('a'), message('b'))
+    gmail.batch_failures = {'b'}
+    gmail.get_errors = {'b': 404}
+    poller = scheduler()
+    assert poller.poll_once() == 1
+    assert load_history_id() == 200
+    assert processed_ids() == {'a', 'b'}
+    assert poller.stats()['skipped'] == {'deleted': 1}
+    assert analyzed == ['a']
+
+
+def test_fetch_failure_holds_the_checkpoint(gmail, scheduler, analyzed):
+    save_history_id(100)
+    add_mail(gmail, message('a'), message('b'))
+    gmail.batch_failures = {'b'}
+    gmail.get_errors = {'b': 500}
+    poller = scheduler()
+    assert poller.poll_once() == 1
+    assert load_history_id() == 100
+
+    del gmail.get_errors['b']
+    assert poller.poll_once() == 1
+    assert load_history_id() == 200
+    assert processed_ids() == {'a', 'b'}
+
+
+def test_triage_skips_bulk_mail_without_fetching_it_in_full(gmail, scheduler, analyzed):
+    save_history_id(100)
+    add_mail(gmail, message('a', sender='no-reply@example.com'), message('b'))
+    gmail.batch_failures = {'a', 'b'}
+    poller = scheduler()
+    poller.poll_once()
+    assert gmail.gets == ['b']
+    assert analyzed == ['b']
+    assert poller.stats()['skipped'] == {'no_reply': 1}
+
+
+def test_only_later_messages_in_a_handled_thread_are_skipped(gmail, scheduler, analyzed):
+    save_history_id(100)
+    add_mail(gmail, message('first', 'thread', internal_date=2000))
+    poller = scheduler()
+    poller.poll_once()
+
+    save_history_id(150)
+    gmail.history_id = '250'
+    gmail.added = []
+    add_mail(gmail, message('earlier', 'thread', internal_date=1000), message('later', 'thread', internal_date=3000))
+    del analyzed[:]
+    poller.poll_once()
+    assert analyzed == ['earlier']
+    assert poller.stats()['skipped'] == {'seen_thread': 1}
+
+
+def test_retried_message_is_not_skipped_for_its_thread(gmail, scheduler, analyzed):
+    save_history_id(100)
+    add_mail(gmail, message('reply', 'thread', internal_date=3000))
+    analyzed.failing = {'reply'}
+    poller = scheduler()
+    poller.poll_once()
+
+    # An earlier message of the thread is handled while the reply waits for its retry
+    mark_skipped([message('first', 'thread', internal_date=2000)])
+    analyzed.failing = set()
+    del analyzed[:]
+    poller.poll_once()
+    assert analyzed == ['reply']
+    assert load_history_id() == 200
+    assert 'seen_thread' not in poller.stats()['skipped']
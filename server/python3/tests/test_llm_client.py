@@ -0,0 +1,165 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from openai import APIStatusError
+
+import llm_client
+from llm_client import LLMClient, TokenBucket
+
+
+def status_error(status, retry_after=None):
+    headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+    # Only the attributes the SDK error and the client's backoff read
+    response = SimpleNamespace(status_code=status, headers=headers, request=None)
+    return APIStatusError(f"HTTP {status}", response=response, body=None)
+
+
+def completion(content='ok', total_tokens=10):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(total_tokens=total_tokens)
+    )
+
+
+class FakeCompletions:
+    """Stands in for AsyncOpenAI().chat.completions, replaying scripted outcomes."""
+
+    def __init__(self, outcomes=(), delay=0.0):
+        self.outcomes = list(outcomes)
+        self.delay = delay
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        outcome = self.outcomes.pop(0) if self.outcomes else completion()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def make_client(monkeypatch):
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setattr(llm_client, 'BACKOFF_BASE', 0.001)
+
+    def make(completions, **kwargs):
+        client = LLMClient(base_url='http://llm.test/v1', **kwargs)
+        client._client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        return client
+    return make
+
+
+def complete(client, deadline=llm_client.CALL_DEADLINE):
+    return client.run(client.complete(
+        model='test', messages=[{'role': 'user', 'content': 'hi'}], max_tokens=10, deadline=deadline
+    ))
+
+
+def test_retries_rate_limits_and_server_errors(make_client):
+    completions = FakeCompletions([status_error(429), status_error(503), completion('done')])
+    client = make_client(completions)
+
+    assert complete(client) == 'done'
+    assert completions.calls == 3
+    assert client.stats()['retries'] == 2
+    assert client.stats()['failures'] == 0
+
+
+def test_waits_as_long_as_retry_after_says(make_client):
+    client = make_client(FakeCompletions([status_error(429, retry_after=0.3), completion()]))
+
+    started = time.monotonic()
+    complete(client)
+    assert time.monotonic() - started >= 0.3
+
+
+def test_client_errors_are_not_retried(make_client):
+    completions = FakeCompletions([status_error(400)])
+    client = make_client(completions)
+
+    with pytest.raises(APIStatusError):
+        complete(client)
+    assert completions.calls == 1
+    assert client.stats()['failures'] == 1
+
+
+def test_gives_up_after_max_retries(make_client, monkeypatch):
+    monkeypatch.setattr(llm_client, 'MAX_RETRIES', 2)
+    completions = FakeCompletions([status_error(500)] * 5)
+    client = make_client(completions)
+
+    with pytest.raises(APIStatusError):
+        complete(client)
+    assert completions.calls == 3
+    assert client.stats()['retries'] == 2
+    assert client.stats()['failures'] == 1
+
+
+def test_deadline_covers_the_whole_call(make_client):
+    client = make_client(FakeCompletions(delay=1.0))
+
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        complete(client, deadline=0.1)
+    assert time.monotonic() - started < 0.5
+    assert client.stats()['deadline_exceeded'] == 1
+
+
+def test_limits_calls_in_flight(make_client):
+    completions = FakeCompletions(delay=0.05)
+    client = make_client(completions, max_in_flight=2)
+
+    async def burst():
+        await asyncio.gather(*(
+            client.complete(model='test', messages=[{'role': 'user', 'content': 'hi'}], max_tokens=10)
+            for _ in range(6)
+        ))
+    client.run(burst())
+    assert completions.calls == 6
+    assert completions.max_in_flight == 2
+
+
+def test_request_rate_limit_delays_calls(make_client):
+    # 600 requests a minute: the bucket starts full, then refills one every 0.1s
+    client = make_client(FakeCompletions(), requests_per_minute=600)
+    client._requests.tokens = 1
+
+    started = time.monotonic()
+    complete(client)
+    complete(client)
+    assert time.monotonic() - started >= 0.09
+    assert client.stats()['rate_limited_s'] > 0
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate_per_minute=600)
+
+    async def take():
+        return await bucket.acquire(600), await bucket.acquire(5)
+    first, second = asyncio.run(take())
+    assert first == 0
+    assert second == pytest.approx(0.5, abs=0.05)
+
+
+def test_token_bucket_adjust_refunds_overestimates():
+    bucket = TokenBucket(rate_per_minute=60)
+    bucket.tokens = 10
+    bucket.adjust(-5)
+    assert bucket.tokens >= 15
+    bucket.adjust(100)
+    assert bucket.tokens < 0
+
+
+def test_stats_absent_until_a_client_exists(monkeypatch):
+    monkeypatch.setattr(llm_client, '_client', None)
+    assert llm_client.llm_client_stats() is None
@@ -0,0 +1,36 @@
+import base64
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import decode_cursor, encode_cursor
+
+
+def raw_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def test_cursor_round_trips():
+    assert decode_cursor(encode_cursor('2026-01-01 00:00:00', 42), 2) == ['2026-01-01 00:00:00', 42]
+    assert decode_cursor(encode_cursor(-1.5, 7), 2) == [-1.5, 7]
+
+
+def test_no_cursor_means_first_page():
+    assert decode_cursor(None, 2) is None
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    base64.urlsafe_b64encode(b'not json').decode(),
+    raw_cursor({'a': 1}),
+    raw_cursor(['only one']),
+    raw_cursor([{'a': 1}, 2]),
+    raw_cursor([[1], 2]),
+    raw_cursor([None, 2]),
+    raw_cursor([True, 2]),
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, 2)
+    assert error.value.status_code == 400
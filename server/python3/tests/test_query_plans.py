@@ -0,0 +1,64 @@
+import pytest
+
+import db
+import listing
+from migrations import QUERY_PLANS, migrate
+
+
+@pytest.fixture(scope='module', autouse=True)
+def schema():
+    migrate()
+
+
+def query_plan(sql, params):
+    rows = db.reader().execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return ' | '.join(row[-1] for row in rows)
+
+
+@pytest.mark.parametrize('sql, params, index', QUERY_PLANS, ids=[index for _, _, index in QUERY_PLANS])
+def test_hot_queries_use_their_index(sql, params, index):
+    plan = query_plan(sql, params)
+    assert index in plan
+    assert 'USE TEMP B-TREE' not in plan
+
+
+@pytest.fixture
+def listing_plans(monkeypatch):
+    """Plans of the queries the listing endpoints run, captured instead of executing them."""
+    plans = []
+
+    def explain(sql, params=()):
+        plans.append(query_plan(sql, params))
+        return []
+    monkeypatch.setattr(db, 'query', explain)
+    return plans
+
+
+# The WHERE clauses main.py builds: first page, a later page and a time window
+TASK_PAGES = [
+    ("", []),
+    ("WHERE created_at <= ? AND (created_at < ? OR id < ?)", ['2026-01-01 00:00:00', '2026-01-01 00:00:00', 10]),
+    ("WHERE created_at >= ? AND created_at < ?", ['2026-01-01 00:00:00', '2026-02-01 00:00:00']),
+]
+SENTIMENT_PAGES = [
+    ("", []),
+    (
+        "WHERE processed_at <= ? AND (processed_at < ? OR msg_id < ?)",
+        ['2026-01-01 00:00:00', '2026-01-01 00:00:00', 'm']
+    ),
+    ("WHERE processed_at >= ? AND processed_at < ?", ['2026-01-01 00:00:00', '2026-02-01 00:00:00']),
+]
+
+
+@pytest.mark.parametrize('where, params', TASK_PAGES)
+def test_task_pages_walk_the_created_index(listing_plans, where, params):
+    listing.tasks_page(where, params, 100, listing.TASK_FIELDS)
+    assert 'idx_tasks_created' in listing_plans[0]
+    assert 'USE TEMP B-TREE' not in listing_plans[0]
+
+
+@pytest.mark.parametrize('where, params', SENTIMENT_PAGES)
+def test_sentiment_pages_walk_the_processed_index(listing_plans, where, params):
+    listing.sentiment_page(where, params, 100, listing.SENTIMENT_FIELDS)
+    assert 'idx_sentiment_processed' in listing_plans[0]
+    assert 'USE TEMP B-TREE' not in listing_plans[0]